@@ -0,0 +1,99 @@
+from itertools import compress
+
+from labyrinth import wallRows
+from solution_generate import ArrayComponents
+
+# Open flags of a row of walls: 1 where there is no wall
+_OPEN = bytes.maketrans(b"\x00\x01", b"\x01\x00")
+
+def analyzeLabyrinth(lab):
+    """
+    Structure of lab, from a single pass over its walls with a union-find
+
+    Return a dict with:
+      cells:          n * m
+      openWalls:      number of open walls between two cells
+      components:     number of connected components
+      cycles:         number of independent cycles, openWalls - cells + components
+      deadEnds:       number of cells with exactly one neighbor
+      isSpanningTree: True if lab is perfect (one component, no cycle)
+      exitReachable:  True if (n-1, m-1) can be reached from (0, 0)
+
+    Unlike the isPerfect result of shortestPath, this covers the whole
+    labyrinth and not only the component of (0, 0).
+    """
+    n, m = lab.n, lab.m
+    cells = n * m
+    components = ArrayComponents(cells)
+    parent, rank = components.parent, components.rank
+    connectIfPossible = components.connectIfPossible
+    verticalRows = wallRows(lab.verticalWalls, n-1, m)
+    horizontalRows = wallRows(lab.horizontalWalls, n, m-1)
+    openWalls = cycles = deadEnds = 0
+    above = b""
+    for i in range(n):
+        base = i * m
+        right = bytes(next(horizontalRows)).translate(_OPEN)
+        below = bytes(next(verticalRows)).translate(_OPEN) if i < n-1 else b""
+        # One byte per cell of the row, adding its open walls on each side
+        openRight = int.from_bytes(right, "little")
+        degrees = (openRight + (openRight << 8) + int.from_bytes(above, "little")
+                   + int.from_bytes(below, "little"))
+        deadEnds += degrees.to_bytes(m, "little").count(1)
+        # The cells of row i are still alone: open walls within the row
+        # cannot close a cycle, each run of cells is linked to its first cell
+        for a in compress(range(base, base + m - 1), right):
+            parent[a + 1] = parent[a]
+            rank[parent[a]] = 1
+        openWalls += right.count(1)
+        for a in compress(range(base - m, base), above):
+            openWalls += 1
+            if not connectIfPossible(a, a + m): cycles += 1
+        above = below
+    return { "n": n, "m": m, "cells": cells, "openWalls": openWalls,
+             "components": cells - openWalls + cycles, "cycles": cycles, "deadEnds": deadEnds,
+             "isSpanningTree": openWalls == cells - 1 and cycles == 0,
+             "exitReachable": components.areConnected(0, cells - 1) }
+
+
+def main(argv = None):
+    """Command line interface; argv defaults to sys.argv[1:], return the exit status"""
+    import argparse
+    import json
+    import sys
+    from labyrinth import STORAGES, loadLabyrinth
+
+    parser = argparse.ArgumentParser("Check the connectivity and perfection of labyrinths")
+    parser.add_argument("files", nargs = "+",
+                        help = "input files, in CSV or binary format ('-' for standard input)")
+    parser.add_argument("--storage", choices = STORAGES, default = None,
+                        help = "Memory layout of the walls (bytes: 1 byte per wall, bits: 1 bit per wall; "
+                               "default: list for CSV, bits for binary files)")
+    parser.add_argument("--json", action = "store_true",
+                        help = "Write one JSON object per file instead of text")
+    parser.add_argument("--check", action = "store_true",
+                        help = "Exit with status 1 if some labyrinth is not perfect")
+
+    args = parser.parse_args(argv)
+    status = 0
+    for filename in args.files:
+        try:
+            result = analyzeLabyrinth(loadLabyrinth(filename, storage = args.storage))
+        except (OSError, ValueError) as e:
+            print("{}: {}".format(filename, e), file = sys.stderr)
+            status = 2
+            continue
+        if args.check and not result["isSpanningTree"]:
+            status = max(status, 1)
+        if args.json:
+            print(json.dumps(dict(file = filename, **result)))
+        else:
+            print("{file}: {n}x{m}, {components} component(s), {cycles} cycle(s), {deadEnds} dead end(s), "
+                  "{perfect}".format(file = filename, perfect = "perfect" if result["isSpanningTree"] else "not perfect",
+                                     **result))
+    return status
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import itertools
+import math
+import os
+import random
+import time
+import tracemalloc
+
+from solution_generate import GenerateLabyrinth2D, GENERATORS
+
+VARIANTS = ("perfect", "imperfect")
+VISITS = ("random", "right", "left", "planar", "manh")
+# Largest side length for the cases that do not scale to big labyrinths
+SIZE_LIMITS = { "generate-slow": 100, "shortest-slow": 1000, "visit-random": 100,
+                "visit-right": 1000, "visit-left": 1000, "visit-planar": 1000, "visit-manh": 1000 }
+
+def measure(function, repeat = 1, memory = True):
+    """
+    Best time of 'repeat' calls of function, and the peak memory allocated
+    by one more call traced with tracemalloc (None if memory is False)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best: best = elapsed
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+def corpusLabyrinth(size, variant, seed = 0):
+    """
+    Labyrinth of the benchmark corpus: size x size, generated with Kruskal
+    from a seed depending on seed, size and variant; imperfect labyrinths
+    have 5% of their walls removed afterwards
+    """
+    random.seed("{}:{}:{}".format(seed, size, variant))
+    lab = GenerateLabyrinth2D(size, size)
+    if variant == "imperfect" and size > 1:
+        lab.removeRandomWalls(size * size // 20)
+    return lab
+
+def caseFunctions(lab, size, variant, filename, seed = 0):
+    """Functions to benchmark on lab, by case name; filename is a scratch file"""
+    import labyrinth
+    from solution_shortest import shortestPath, fastShortestPath
+    from solution_visit import STRATEGIES, wallFollowerVisit
+    from visit import HeadlessVisit
+
+    def saveCSV():
+        with open(filename, 'w') as out:
+            lab.saveCSV(out)
+    def loadCSV():
+        with open(filename) as file:
+            labyrinth.Labyrinth2DFromFile(file)
+    def saveBinary():
+        with open(filename + ".bin", 'wb') as out:
+            lab.saveBinary(out)
+    def loadBinary():
+        labyrinth.Labyrinth2DFromBinary(filename + ".bin", storage = "list")
+    def visit(strategy):
+        return lambda: STRATEGIES[strategy](HeadlessVisit(lab), random.Random(seed))
+
+    cases = { "save-csv": saveCSV, "load-csv": loadCSV,
+              "save-binary": saveBinary, "load-binary": loadBinary,
+              "shortest-slow": lambda: shortestPath(lab),
+              "shortest": lambda: fastShortestPath(lab) }
+    for strategy in VISITS:
+        # planarVisit only works on perfect labyrinths
+        if strategy != "planar" or variant == "perfect":
+            cases["visit-" + strategy] = visit(strategy)
+    cases["visit-analytic"] = lambda: (wallFollowerVisit(lab, "left"), wallFollowerVisit(lab, "right"))
+    return cases
+
+def caseNames(algos):
+    """Names of all the benchmark cases, in order"""
+    return ([ "generate-" + algo for algo in algos ] + [ "generate-slow" ]
+            + [ "save-csv", "load-csv", "save-binary", "load-binary", "shortest-slow", "shortest" ]
+            + [ "visit-" + strategy for strategy in VISITS ] + [ "visit-analytic" ])
+
+def runSuite(sizes, algos = tuple(GENERATORS), cases = None, repeat = 1, seed = 0, memory = True, log = None):
+    """
+    Run the benchmark cases (default: all, see caseNames) on the corpus
+    labyrinths of the given sizes, both perfect and imperfect
+
+    Return a list of dicts with the case, size, variant, best time over
+    'repeat' runs, throughput in cells per second and peak memory in bytes.
+    log, if given, is called with each result as soon as it is measured.
+    """
+    import tempfile
+    names = caseNames(algos)
+    if cases is not None:
+        names = [ name for name in names if name in cases ]
+    results = []
+    def record(name, size, variant, seconds, peak):
+        result = { "case": name, "size": size, "variant": variant, "seconds": seconds,
+                   "cellsPerSecond": size * size / seconds if seconds else None, "peakBytes": peak }
+        results.append(result)
+        if log is not None: log(result)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "corpus.csv")
+        for size in sizes:
+            def skipped(name):
+                return name not in names or size > SIZE_LIMITS.get(name, size)
+            # Generation works on perfect labyrinths; the variants share the seed
+            for name in names:
+                if not name.startswith("generate-") or skipped(name): continue
+                runs = itertools.count()
+                def generate():
+                    random.seed("{}:{}:generate:{}".format(seed, size, next(runs)))
+                    if name == "generate-slow":
+                        GenerateLabyrinth2D(size, size, slow = True)
+                    else:
+                        GenerateLabyrinth2D(size, size, algo = name[len("generate-"):])
+                record(name, size, "perfect", *measure(generate, repeat, memory))
+            for variant in VARIANTS:
+                lab = corpusLabyrinth(size, variant, seed)
+                functions = caseFunctions(lab, size, variant, filename, seed)
+                # Files read by the load cases
+                functions["save-csv"]()
+                functions["save-binary"]()
+                for name in names:
+                    if name in functions and not skipped(name):
+                        record(name, size, variant, *measure(functions[name], repeat, memory))
+    return results
+
+def scaling(results):
+    """
+    Scaling curves of the results: for each case and variant, the list of
+    [cells, seconds] by increasing size, and the exponent e of the best fit
+    of seconds ~ cells^e (None with less than 2 sizes)
+    """
+    curves = {}
+    for r in results:
+        curves.setdefault("{}/{}".format(r["case"], r["variant"]), []).append([r["size"] ** 2, r["seconds"]])
+    summary = {}
+    for key, points in curves.items():
+        points.sort()
+        exponent = None
+        logs = [ (math.log(c), math.log(s)) for c, s in points if s > 0 ]
+        if len(logs) >= 2:
+            mx = sum(x for x, _ in logs) / len(logs)
+            my = sum(y for _, y in logs) / len(logs)
+            variance = sum((x - mx) ** 2 for x, _ in logs)
+            if variance > 0:
+                exponent = sum((x - mx) * (y - my) for x, y in logs) / variance
+        summary[key] = { "points": points, "exponent": exponent }
+    return summary
+
+def compareToBaseline(results, baseline, tolerance = 0.2):
+    """
+    Results slower than their counterpart in baseline (same case, size and
+    variant) by more than the relative tolerance, as (result, ratio) pairs
+    """
+    previous = { (r["case"], r["size"], r["variant"]): r["seconds"] for r in baseline }
+    regressions = []
+    for r in results:
+        before = previous.get((r["case"], r["size"], r["variant"]))
+        if before and r["seconds"] > before * (1 + tolerance):
+            regressions.append((r, r["seconds"] / before))
+    return regressions
+
+def report(results, seed, repeat):
+    """Machine-readable report of a suite run"""
+    import platform
+    import sys
+    return { "python": sys.version.split()[0], "platform": platform.platform(),
+             "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": seed, "repeat": repeat,
+             "results": results, "scaling": scaling(results) }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+    from contextlib import nullcontext
+
+    parser = argparse.ArgumentParser("Benchmark the labyrinth tools")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [100, 1000, 4000],
+                        help = "Side lengths of the corpus labyrinths (default: 100 1000 4000)")
+    parser.add_argument("--algos", nargs = "+", choices = GENERATORS, default = list(GENERATORS),
+                        help = "Generation algorithms to benchmark")
+    parser.add_argument("--cases", nargs = "+", choices = caseNames(GENERATORS), default = None,
+                        help = "Cases to run (default: all; some only run on small sizes)")
+    parser.add_argument("--repeat", type = int, default = 3,
+                        help = "Number of runs per measure, the best one is kept")
+    parser.add_argument("--seed", type = int, default = 0,
+                        help = "Seed of the corpus (default: 0)")
+    parser.add_argument("--no-memory", dest = "memory", action = "store_false",
+                        help = "Do not measure the peak memory (saves one traced run per measure)")
+    parser.add_argument("--json", metavar = "FILE", default = None,
+                        help = "Save the results in JSON format in FILE ('-' for standard output)")
+    parser.add_argument("--baseline", metavar = "FILE", default = None,
+                        help = "Compare to the results saved with --json in FILE, "
+                               "and exit with status 1 on regressions")
+    parser.add_argument("--tolerance", type = float, default = 0.2,
+                        help = "Relative slowdown tolerated by --baseline (default: 0.2)")
+    args = parser.parse_args()
+
+    table = sys.stderr if args.json == "-" else sys.stdout
+    print("{:<20} {:>6} {:<10} {:>10} {:>14} {:>12}".format("case", "size", "variant", "seconds",
+                                                           "cells/sec", "peak MB"), file = table)
+    def log(r):
+        peak = "{:.1f}".format(r["peakBytes"] / 2**20) if r["peakBytes"] is not None else "-"
+        print("{case:<20} {size:>6} {variant:<10} {seconds:>10.3f} {:>14.0f} {:>12}".format(
+            r["cellsPerSecond"] or 0, peak, **r), file = table, flush = True)
+    results = runSuite(args.sizes, args.algos, args.cases, args.repeat, args.seed, args.memory, log)
+
+    if args.json:
+        with open(args.json, 'w') if args.json != "-" else nullcontext(sys.stdout) as out:
+            json.dump(report(results, args.seed, args.repeat), out, indent = 1)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = compareToBaseline(results, baseline, args.tolerance)
+        for r, ratio in regressions:
+            print("Regression: {case} {size} {variant}: {seconds:.3f}s, {:.2f} times the baseline".format(
+                ratio, **r), file = sys.stderr)
+        if regressions:
+            sys.exit(1)
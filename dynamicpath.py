@@ -0,0 +1,185 @@
+import heapq
+from array import array
+from collections import deque
+
+from labyrinth import NEIGHBOR_OFFSETS, DOWN, RIGHT
+
+class DynamicDistances:
+    """
+    BFS distances from a source cell, kept up to date while walls are
+    removed or added
+
+    Edits go through removeWall and addWall, which change the labyrinth
+    (and its compiled adjacency) and only revisit the cells whose distance
+    changes: cells that get closer after a removal, or that lose all their
+    shortest paths after an addition.
+
+    Attributes:
+      distances: distances[c] is the distance from the source to cell id
+                 c = i*m + j, -1 if c cannot be reached
+      reachable: number of cells reachable from the source
+      edges:     number of open walls between reachable cells
+    """
+
+    def __init__(self, lab, source = (0, 0)):
+        self.labyrinth = lab
+        self.n, self.m = lab.n, lab.m
+        self.source = source[0] * self.m + source[1]
+        self.masks = lab.compileAdjacency().masks
+        self.deltas = [ tuple(di * self.m + dj for di, dj in offsets) for offsets in NEIGHBOR_OFFSETS ]
+        self.distances = array('i', [-1]) * (self.n * self.m)
+        self.distances[self.source] = 0
+        self.reachable = 0
+        self.edges = 0
+        self._reach([self.source])
+
+    @property
+    def isPerfect(self):
+        """True if the cells reachable from the source form a tree"""
+        return self.edges == self.reachable - 1
+
+    def distance(self, pos):
+        """Distance from the source to position pos, -1 if it cannot be reached"""
+        return self.distances[pos[0] * self.m + pos[1]]
+
+    def path(self, target = None):
+        """
+        A shortest path from the source (excluded) to target (default:
+        (n-1, m-1)) as a list of cells, like solution_shortest.findPath
+
+        Raise ValueError if target cannot be reached
+        """
+        if target is None: target = (self.n - 1, self.m - 1)
+        distances, masks, deltas = self.distances, self.masks, self.deltas
+        current = target[0] * self.m + target[1]
+        if distances[current] < 0:
+            raise ValueError("No path from {} to {}".format(divmod(self.source, self.m), target))
+        path = []
+        while current != self.source:
+            path.append(divmod(current, self.m))
+            d = distances[current] - 1
+            for delta in deltas[masks[current]]:
+                if distances[current + delta] == d:
+                    current += delta
+                    break
+        path.reverse()
+        return path
+
+    def _cells(self, i, j, isVertical):
+        a = i * self.m + j
+        if isVertical: return a, a + self.m, DOWN
+        return a, a + 1, RIGHT
+
+    def removeWall(self, i, j, isVertical):
+        """Remove the wall after (i, j) (see Labyrinth2D.removeWall) and update the distances"""
+        a, b, bit = self._cells(i, j, isVertical)
+        if self.masks[a] & bit: return
+        self.labyrinth.removeWall(i, j, isVertical)
+        distances = self.distances
+        if distances[a] < 0 and distances[b] < 0: return
+        if distances[a] < 0 or distances[b] < 0:
+            # The component of the unreachable cell becomes reachable
+            if distances[a] < 0: a, b = b, a
+            distances[b] = distances[a] + 1
+            self.edges += 1
+            self._reach([b], previous = a)
+            return
+        self.edges += 1
+        if distances[a] > distances[b]: a, b = b, a
+        if distances[b] > distances[a] + 1:
+            distances[b] = distances[a] + 1
+            self._decrease(b)
+
+    def addWall(self, i, j, isVertical):
+        """Add the wall after (i, j) (see Labyrinth2D.addWall) and update the distances"""
+        a, b, bit = self._cells(i, j, isVertical)
+        if not self.masks[a] & bit: return
+        self.labyrinth.addWall(i, j, isVertical)
+        distances = self.distances
+        if distances[a] < 0: return
+        self.edges -= 1
+        if distances[a] == distances[b]: return
+        if distances[a] > distances[b]: a, b = b, a
+        self._increase(b)
+
+    def _reach(self, cells, previous = None):
+        """
+        BFS from cells, whose distances are set, over unreachable cells; the
+        edge from previous to the first cell is already counted
+        """
+        distances, masks, deltas = self.distances, self.masks, self.deltas
+        candidates = deque(cells)
+        degrees = 0
+        while candidates:
+            p = candidates.popleft()
+            self.reachable += 1
+            d = distances[p] + 1
+            for delta in deltas[masks[p]]:
+                q = p + delta
+                degrees += 1
+                if distances[q] < 0:
+                    distances[q] = d
+                    candidates.append(q)
+        if previous is not None: degrees -= 1
+        self.edges += degrees // 2
+
+    def _decrease(self, start):
+        """Propagate the decreased distance of start"""
+        distances, masks, deltas = self.distances, self.masks, self.deltas
+        candidates = deque([start])
+        while candidates:
+            p = candidates.popleft()
+            d = distances[p] + 1
+            for delta in deltas[masks[p]]:
+                q = p + delta
+                if distances[q] > d:
+                    distances[q] = d
+                    candidates.append(q)
+
+    def _increase(self, start):
+        """Update the distances after start lost a neighbor one step closer to the source"""
+        distances, masks, deltas = self.distances, self.masks, self.deltas
+
+        def isSupported(p):
+            d = distances[p] - 1
+            return any(distances[p + delta] == d and p + delta not in affected for delta in deltas[masks[p]])
+
+        # Cells that lost all their shortest paths, by increasing distance
+        affected = set()
+        if isSupported(start): return
+        affected.add(start)
+        candidates = deque([start])
+        while candidates:
+            p = candidates.popleft()
+            d = distances[p] + 1
+            for delta in deltas[masks[p]]:
+                q = p + delta
+                if distances[q] == d and q not in affected and not isSupported(q):
+                    affected.add(q)
+                    candidates.append(q)
+
+        # New distances of the affected cells, from their unaffected neighbors
+        heap = []
+        for p in affected:
+            best = -1
+            for delta in deltas[masks[p]]:
+                q = p + delta
+                if q not in affected and distances[q] >= 0 and (best < 0 or distances[q] + 1 < best):
+                    best = distances[q] + 1
+            distances[p] = -1
+            if best >= 0:
+                heap.append((best, p))
+        heapq.heapify(heap)
+        while heap:
+            d, p = heapq.heappop(heap)
+            if distances[p] >= 0: continue
+            distances[p] = d
+            for delta in deltas[masks[p]]:
+                q = p + delta
+                if distances[q] < 0:
+                    heapq.heappush(heap, (d + 1, q))
+
+        # Affected cells left unreachable are cut from the source with their edges
+        lost = [ p for p in affected if distances[p] < 0 ]
+        self.reachable -= len(lost)
+        self.edges -= sum(len(deltas[masks[p]]) for p in lost) // 2
@@ -1,4 +1,286 @@
-import csv
+import io
+import re
+import struct
+from array import array
+from contextlib import contextmanager
+from itertools import accumulate, chain, compress
+
+STORAGES = ("list", "bytes", "bits")
+
+# Directions of the neighbors of a cell, in the order of Labyrinth2D.neighbors,
+# as bits of a mask and the corresponding moves (di, dj)
+UP, LEFT, DOWN, RIGHT = 1, 2, 4, 8
+DIRECTIONS = ((UP, -1, 0), (LEFT, 0, -1), (DOWN, 1, 0), (RIGHT, 0, 1))
+# NEIGHBOR_OFFSETS[mask] lists the moves of the directions present in mask
+NEIGHBOR_OFFSETS = [ tuple((di, dj) for bit, di, dj in DIRECTIONS if mask & bit) for mask in range(16) ]
+_DEGREES = bytes(len(offsets) for offsets in NEIGHBOR_OFFSETS).ljust(256, b"\0")
+_OPEN_TO = { bit: bytes.maketrans(b"\x00\x01", bytes((bit, 0))) for bit, _, _ in DIRECTIONS }
+
+# Binary format: header (magic, version, reserved, n, m), then the vertical
+# and the horizontal walls as bitmaps, row after row, least significant bit first
+BINARY_MAGIC = b"LABY"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sHHII")
+
+CSV_LINE_END = "\r\n"   # as written by csv.writer
+CSV_CHUNK_SIZE = 1 << 20
+# Smaller CSV files are read faster without NumPy than with its import
+CSV_NUMPY_MIN_CELLS = 1 << 17
+# Lines that the bulk CSV reader parses without csv.reader, other lines
+# (quotes, other spacing, huge numbers...) go through csv.reader
+_CSV_BULK_LINES = re.compile(r"(?:[+-]?[0-9]{1,9} [+-]?[0-9]{1,9} [VH]\r?\n)*"
+                             r"(?:[+-]?[0-9]{1,9} [+-]?[0-9]{1,9} [VH]\r?)?")
+
+class PackedWalls:
+    """
+    Bit-packed 2D array of walls, indexed as walls[i][j] like a list of lists
+
+    Uses one bit per wall, stored row after row in 'buffer' (a bytearray by
+    default, or any writable buffer such as a memory-mapped file).
+    """
+
+    def __init__(self, rows, cols, value = False, buffer = None):
+        self.rows = rows
+        self.cols = cols
+        if buffer is None:
+            buffer = bytearray(b'\xff' if value else b'\x00') * ((rows * cols + 7) // 8)
+        self.bits = buffer
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, i):
+        if i < 0: i += self.rows
+        if i < 0 or i >= self.rows:
+            raise IndexError("row index out of range")
+        return PackedRow(self.bits, i * self.cols, self.cols)
+
+    def __iter__(self):
+        for i in range(self.rows):
+            yield PackedRow(self.bits, i * self.cols, self.cols)
+
+    def rowFlags(self, start, stop):
+        """Walls of rows start..stop-1, as a bytearray of 0/1 values"""
+        first = start * self.cols
+        last = stop * self.cols
+        shift = first & 7
+        return unpackBits(self.bits[first >> 3:(last + 7) >> 3], last - first + shift)[shift:]
+
+
+class PackedRow:
+    """View on one row of a PackedWalls array"""
+
+    __slots__ = ("bits", "start", "cols")
+
+    def __init__(self, bits, start, cols):
+        self.bits = bits
+        self.start = start
+        self.cols = cols
+
+    def __len__(self):
+        return self.cols
+
+    def __getitem__(self, j):
+        if j < 0: j += self.cols
+        if j < 0 or j >= self.cols:
+            raise IndexError("column index out of range")
+        k = self.start + j
+        return bool(self.bits[k >> 3] >> (k & 7) & 1)
+
+    def __setitem__(self, j, value):
+        if j < 0: j += self.cols
+        if j < 0 or j >= self.cols:
+            raise IndexError("column index out of range")
+        k = self.start + j
+        if value:
+            self.bits[k >> 3] |= 1 << (k & 7)
+        else:
+            self.bits[k >> 3] &= ~(1 << (k & 7)) & 0xff
+
+    def __iter__(self):
+        bits = self.bits
+        for k in range(self.start, self.start + self.cols):
+            yield bool(bits[k >> 3] >> (k & 7) & 1)
+
+
+def makeWalls(rows, cols, value, storage = "list"):
+    """
+    Create a rows x cols array of walls, all set to 'value'
+
+    storage is one of:
+      "list":  list of lists of bool (default, fastest access)
+      "bytes": list of bytearray, one byte per wall
+      "bits":  PackedWalls, one bit per wall
+    """
+    if storage == "list":
+        return [ [value] * cols for i in range(rows) ]
+    if storage == "bytes":
+        return [ bytearray([value]) * cols for i in range(rows) ]
+    if storage == "bits":
+        return PackedWalls(rows, cols, value)
+    raise ValueError("Unknown storage {}, expected one of {}".format(storage, ", ".join(STORAGES)))
+
+
+_BITS_TO_ASCII = bytes.maketrans(b"\x00\x01", b"01")
+_ASCII_TO_BITS = bytes.maketrans(b"01", b"\x00\x01")
+
+def packBits(flags):
+    """Pack a sequence of 0/1 values into bytes, least significant bit first"""
+    if not flags: return b""
+    return int(bytes(flags[::-1]).translate(_BITS_TO_ASCII), 2).to_bytes((len(flags) + 7) // 8, "little")
+
+def unpackBits(data, count):
+    """Inverse of packBits: return a bytearray of 'count' 0/1 values"""
+    if not count: return bytearray()
+    value = int.from_bytes(data[:(count + 7) // 8], "little")
+    return bytearray(format(value, "0{}b".format(count)).encode()[::-1][:count].translate(_ASCII_TO_BITS))
+
+def packWalls(walls, rows, cols):
+    """Bitmap of a wall array, in the layout of PackedWalls"""
+    if isinstance(walls, PackedWalls):
+        return bytes(walls.bits[:(rows * cols + 7) // 8])
+    return packBits(b"".join(bytes(row) for row in walls))
+
+def wallRows(walls, rows, cols):
+    """Iterate over the rows of a wall array, as sequences of truth values"""
+    if not isinstance(walls, PackedWalls):
+        return iter(walls)
+    return _packedWallRows(walls, rows, cols)
+
+def _packedWallRows(walls, rows, cols, block = 1024):
+    for start in range(0, rows, block):
+        stop = min(start + block, rows)
+        flags = walls.rowFlags(start, stop)
+        for k in range(stop - start):
+            yield flags[k * cols:(k+1) * cols]
+
+def wallLines(i, tokens, walls):
+    """
+    CSV lines of the walls present in row i: tokens[j] is the end of the line
+    for a wall at (i, j), and walls[j] is True if this wall is present
+    """
+    selected = list(compress(tokens, walls))
+    if not selected: return ""
+    prefix = "{} ".format(i)
+    return prefix + (CSV_LINE_END + prefix).join(selected) + CSV_LINE_END
+
+def loadLabyrinth(filename, storage = None):
+    """
+    Load a labyrinth from a file in CSV or binary format (detected from its content)
+
+    '-' reads CSV from the standard input. storage defaults to "list" for
+    CSV files and to "bits" for binary files, which maps the file in memory.
+    """
+    if filename == "-":
+        import sys
+        return Labyrinth2DFromFile(sys.stdin, storage = storage or "list")
+    with open(filename, "rb") as file:
+        isBinary = file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+    if isBinary:
+        return Labyrinth2DFromBinary(filename, storage = storage or "bits")
+    with open(filename) as file:
+        return Labyrinth2DFromFile(file, storage = storage or "list")
+
+@contextmanager
+def binaryLabyrinthFile(filename = None, lab = None):
+    """
+    Context giving the name of a file with the labyrinth in binary format,
+    to share it between processes (see Labyrinth2DFromBinary)
+
+    This is filename itself if it is already in binary format; otherwise a
+    temporary file is written from lab (loaded from filename if not given)
+    and removed at exit.
+    """
+    if filename is not None and filename != "-":
+        with open(filename, "rb") as file:
+            if file.read(len(BINARY_MAGIC)) == BINARY_MAGIC:
+                yield filename
+                return
+    import os
+    import tempfile
+    if lab is None: lab = loadLabyrinth(filename)
+    with tempfile.NamedTemporaryFile(suffix = ".lab", delete = False) as file:
+        lab.saveBinary(file)
+    try:
+        yield file.name
+    finally:
+        os.remove(file.name)
+
+def writeStripsCSV(file, n, m, strips):
+    """
+    Save a n x m labyrinth given strip by strip to file in CSV format
+
+    strips yields (i, horizontal, vertical) like solution_generate.ellerRows:
+    horizontal[j] is the wall between (i, j) and (i, j+1), vertical[j] the
+    wall between (i, j) and (i+1, j), or None for the last strip. Walls are
+    written as soon as their strip is received, so the labyrinth is never
+    stored. The lines are grouped by strip instead of by wall type, which
+    Labyrinth2DFromFile reads all the same.
+    """
+    file.write("{} {}{}".format(n, m, CSV_LINE_END))
+    verticalTokens = [ "{} V".format(j) for j in range(m) ]
+    horizontalTokens = [ "{} H".format(j) for j in range(m-1) ]
+    for i, horizontal, vertical in strips:
+        if vertical is not None:
+            file.write(wallLines(i, verticalTokens, vertical))
+        file.write(wallLines(i, horizontalTokens, horizontal))
+
+
+class Adjacency:
+    """
+    Compiled neighbor table of a labyrinth (see Labyrinth2D.compileAdjacency)
+
+    Attributes:
+      masks:   bytearray of the open directions of each cell id i*m + j,
+               as returned by Labyrinth2D.directionMasks
+      offsets, targets: CSR form of the neighbor lists, as arrays of cell
+               ids: the neighbors of c are targets[offsets[c]:offsets[c+1]]
+
+    Neighbors are in the order of Labyrinth2D.neighbors. The CSR arrays are
+    built on first use, and dropped when a wall changes.
+    """
+
+    def __init__(self, n, m, masks):
+        self.n = n
+        self.m = m
+        self.masks = masks
+        self._csr = None
+
+    def neighbors(self, pos):
+        """List of neighboring cells of position pos"""
+        i, j = pos
+        return [ (i + di, j + dj) for di, dj in NEIGHBOR_OFFSETS[self.masks[i * self.m + j]] ]
+
+    def csr(self):
+        """Return the (offsets, targets) arrays, building them if needed"""
+        if self._csr is None:
+            m = self.m
+            deltas = [ tuple(di * m + dj for di, dj in offsets) for offsets in NEIGHBOR_OFFSETS ]
+            masks = self.masks
+            offsets = array('q', accumulate(masks.translate(_DEGREES), initial = 0))
+            targets = array('i', [ c + d for c, mask in enumerate(masks) for d in deltas[mask] ])
+            self._csr = (offsets, targets)
+        return self._csr
+
+    def neighborIds(self, c):
+        """Neighbors of cell id c, as an array of cell ids"""
+        offsets, targets = self.csr()
+        return targets[offsets[c]:offsets[c+1]]
+
+    def setWall(self, i, j, isVertical, value):
+        """Update the table after a change of the wall after (i, j)"""
+        a = i * self.m + j
+        if isVertical: b, bitA, bitB = a + self.m, DOWN, UP
+        else: b, bitA, bitB = a + 1, RIGHT, LEFT
+        masks = self.masks
+        if value:
+            masks[a] &= ~bitA
+            masks[b] &= ~bitB
+        else:
+            masks[a] |= bitA
+            masks[b] |= bitB
+        self._csr = None
+
 
 #class by Lionel Eyraud Dubois <lionel.eyraud-dubois@u-bordeaux.fr>
 class Labyrinth2D:
@@ -11,31 +293,107 @@ class Labyrinth2D:
         verticalWalls[i][j] is True iff there is a wall between (i, j) and (i+1, j)
       horizontalWalls: n x m-1 array
         horizontalWalls[i][j] is True iff there is a wall between (i, j) and (i, j+1)
+
+    Both arrays are indexed as [i][j], whatever their storage (see makeWalls).
+
+    compileAdjacency() caches a neighbor table, used by neighbors() and the
+    solvers. It is kept up to date by removeWall and addWall; after changing
+    the wall arrays directly, call invalidateAdjacency().
     """
 
-    def __init__(self, n, m):
+    _adjacency = None
+
+    def __init__(self, n, m, storage = "list"):
         """Create a new labyrinth with all walls present"""
 
         self.n = n
         self.m = m
-        self.verticalWalls = [ [True] * self.m for i in range(self.n-1) ]
-        self.horizontalWalls = [ [True] * (self.m-1) for i in range(self.n) ]
+        self.verticalWalls = makeWalls(self.n-1, self.m, True, storage)
+        self.horizontalWalls = makeWalls(self.n, self.m-1, True, storage)
 
     def saveCSV(self, file):
         """Save the labyrinth to file in CSV format"""
 
-        writer = csv.writer(file, delimiter=' ')
-        writer.writerow((self.n, self.m))
-        for i in range(self.n - 1):
-            for j in range(self.m):
-                if self.verticalWalls[i][j]: writer.writerow((i, j, 'V'))
-        for i in range(self.n):
-            for j in range(self.m-1):
-                if self.horizontalWalls[i][j]: writer.writerow((i, j, 'H'))
+        file.write("{} {}{}".format(self.n, self.m, CSV_LINE_END))
+        for walls, rows, cols, kind in ((self.verticalWalls, self.n-1, self.m, 'V'),
+                                        (self.horizontalWalls, self.n, self.m-1, 'H')):
+            tokens = [ "{} {}".format(j, kind) for j in range(cols) ]
+            lines = []
+            size = 0
+            for i, row in enumerate(wallRows(walls, rows, cols)):
+                lines.append(wallLines(i, tokens, row))
+                size += cols
+                if size >= CSV_CHUNK_SIZE // 8:
+                    file.write("".join(lines))
+                    lines = []
+                    size = 0
+            file.write("".join(lines))
+
+    def saveBinary(self, file):
+        """Save the labyrinth to file (opened in binary mode) in binary format"""
+
+        file.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, self.n, self.m))
+        file.write(packWalls(self.verticalWalls, self.n-1, self.m))
+        file.write(packWalls(self.horizontalWalls, self.n, self.m-1))
+
+    def directionMasks(self):
+        """
+        Return the open directions of all cells, as a bytearray indexed by
+        cell id i*m + j: bit UP (resp. LEFT, DOWN, RIGHT) is set iff there is
+        no wall between (i, j) and (i-1, j) (resp. (i, j-1), (i+1, j), (i, j+1))
+        """
+        if self._adjacency is not None:
+            return bytearray(self._adjacency.masks)
+        n, m = self.n, self.m
+        masks = bytearray(n * m)
+        verticalRows = wallRows(self.verticalWalls, n-1, m)
+        horizontalRows = wallRows(self.horizontalWalls, n, m-1)
+        above = None
+        for i in range(n):
+            horizontal = bytes(next(horizontalRows))
+            row = (int.from_bytes(horizontal.translate(_OPEN_TO[RIGHT]), "little")
+                   | int.from_bytes(horizontal.translate(_OPEN_TO[LEFT]), "little") << 8)
+            if above is not None:
+                row |= int.from_bytes(above.translate(_OPEN_TO[UP]), "little")
+            if i < n-1:
+                above = bytes(next(verticalRows))
+                row |= int.from_bytes(above.translate(_OPEN_TO[DOWN]), "little")
+            masks[i * m:(i+1) * m] = row.to_bytes(m, "little")
+        return masks
+
+    def compileAdjacency(self):
+        """Return the Adjacency of the labyrinth, built on first call"""
+        if self._adjacency is None:
+            self._adjacency = Adjacency(self.n, self.m, self.directionMasks())
+        return self._adjacency
+
+    def invalidateAdjacency(self):
+        """Drop the compiled Adjacency, after a direct change of the walls"""
+        self._adjacency = None
+
+    def removeWall(self, i, j, isVertical):
+        """Remove the wall between (i, j) and (i+1, j) if isVertical, (i, j+1) otherwise"""
+        if isVertical:
+            self.verticalWalls[i][j] = False
+        else:
+            self.horizontalWalls[i][j] = False
+        if self._adjacency is not None:
+            self._adjacency.setWall(i, j, isVertical, False)
+
+    def addWall(self, i, j, isVertical):
+        """Add the wall between (i, j) and (i+1, j) if isVertical, (i, j+1) otherwise"""
+        if isVertical:
+            self.verticalWalls[i][j] = True
+        else:
+            self.horizontalWalls[i][j] = True
+        if self._adjacency is not None:
+            self._adjacency.setWall(i, j, isVertical, True)
 
     def neighbors(self, pos):
         """Return the list of neighboring cells of position pos"""
 
+        if self._adjacency is not None:
+            return self._adjacency.neighbors(pos)
         i, j = pos
         result = []
         if i > 0:
@@ -108,8 +466,23 @@ class Labyrinth2D:
         print(wallChar * (2*self.n + 1))
 
 
-    def draw(self, filename, path = None, cell_size = 40, margin = 10):
+    def draw(self, filename, path = None, cell_size = 40, margin = 10, start = (0, 0), backend = None):
+        """
+        Draw the labyrinth, and path from start if given, to an image file
+
+        backend is "raster" (PNG or PPM, see raster.py, no dependency) or
+        "wand" (any format of ImageMagick); by default, raster is used for
+        .png, .ppm and .pnm files.
+        """
 
+        if backend is None:
+            import os
+            from raster import RASTER_FORMATS
+            backend = "raster" if os.path.splitext(filename)[1].lower() in RASTER_FORMATS else "wand"
+        if backend == "raster":
+            from raster import drawRaster
+            drawRaster(self, filename, path, cell_size, margin, start)
+            return
         try:
             from wand.color import Color
             from wand.image import Image
@@ -156,7 +529,7 @@ class Labyrinth2D:
 
                 if path:
                     draw.stroke_color = Color('red')
-                    pos = (0, 0)
+                    pos = start
                     for p in path:
                         line(draw, center(pos), center(p))
                         pos = p
@@ -168,40 +541,228 @@ class Labyrinth2D:
 class Labyrinth2DFromFile(Labyrinth2D):
     """Labyrinth class created by reading from a file in CSV format"""
 
-    def __init__(self, file):
+    def __init__(self, file, storage = "list"):
         """
-        Create the labyrinth by reading from 'file'
+        Create the labyrinth by reading from 'file', see makeWalls for 'storage'
+
+        The file is read by large chunks, parsed in bulk (with NumPy if it is
+        installed, for large labyrinths or if it is already imported); from
+        the first chunk which is not made of plain "i j V" lines, the rest of
+        the file is read line by line with csv.reader.
 
         Raise ValueError if the file does not respect the format
         """
-        reader = csv.reader(file, delimiter = ' ')
+        import csv
+        import sys
+        line = 1
         try:
-            rowSize = next(reader)
-            line = 1
+            rowSize = next(csv.reader([file.readline()], delimiter = ' '))
             if len(rowSize) != 2:
                 raise ValueError('First Line should have length 2, not {}'.format(len(rowSize)))
             self.n = int(rowSize[0])
             self.m = int(rowSize[1])
-            self.verticalWalls = [ [False] * self.m for i in range(self.n-1) ]
-            self.horizontalWalls = [ [False] * (self.m-1) for i in range(self.n) ]
-            for row in reader:
-                line += 1
-                if len(row) != 3:
-                    raise ValueError('Lines after the first should have length 3, not {}'.format(len(rowSize)))
-                i = int(row[0])
-                j = int(row[1])
-                t = row[2]
-                if t == 'V':
-                    if i >= 0 and i < self.n-1 and j >= 0 and j < self.m:
-                        self.verticalWalls[i][j] = True
-                    else:
-                        raise ValueError('Position {}, {} is not valid for a vertical wall'.format(i, j))
-                elif t == 'H':
-                    if i >= 0 and i < self.n and j >= 0 and j < self.m-1:
-                        self.horizontalWalls[i][j] = True
-                    else:
-                        raise ValueError('Position {}, {} is not valid for a horizontal wall'.format(i, j))
+            if storage not in STORAGES:
+                raise ValueError("Unknown storage {}, expected one of {}".format(storage, ", ".join(STORAGES)))
+            numpy = None
+            if self.n * self.m >= CSV_NUMPY_MIN_CELLS or "numpy" in sys.modules:
+                numpy = _importNumpy()
+            if numpy is not None:
+                self.verticalWalls = numpy.zeros((max(self.n-1, 0), max(self.m, 0)), dtype = bool)
+                self.horizontalWalls = numpy.zeros((max(self.n, 0), max(self.m-1, 0)), dtype = bool)
+            else:
+                self.verticalWalls = makeWalls(self.n-1, self.m, False, storage)
+                self.horizontalWalls = makeWalls(self.n, self.m-1, False, storage)
+
+            pending = ""
+            while True:
+                data = file.read(CSV_CHUNK_SIZE)
+                if data:
+                    data = pending + data
+                    cut = data.rfind("\n") + 1
+                    chunk, pending = data[:cut], data[cut:]
                 else:
-                    raise ValueError('Type {} is not valid, only V and H allowed'.format(t))
+                    chunk, pending = pending, ""
+                if chunk:
+                    if not self.readChunk(chunk, numpy):
+                        rows = csv.reader(chain(io.StringIO(chunk + pending + file.readline()), file), delimiter = ' ')
+                        for row in rows:
+                            line += 1
+                            self.readRow(row)
+                        break
+                    line += chunk.count("\n") + (not chunk.endswith("\n"))
+                if not data: break
         except ValueError as e:
             raise ValueError("Line {}, error: {}".format(line, e))
+        if numpy is not None:
+            self.verticalWalls = wallsFromArray(numpy, self.verticalWalls, storage)
+            self.horizontalWalls = wallsFromArray(numpy, self.horizontalWalls, storage)
+
+    def readRow(self, row):
+        """Add the wall described by one CSV row"""
+        if len(row) != 3:
+            raise ValueError('Lines after the first should have length 3, not {}'.format(len(row)))
+        i = int(row[0])
+        j = int(row[1])
+        t = row[2]
+        if t == 'V':
+            if i >= 0 and i < self.n-1 and j >= 0 and j < self.m:
+                self.verticalWalls[i][j] = True
+            else:
+                raise ValueError('Position {}, {} is not valid for a vertical wall'.format(i, j))
+        elif t == 'H':
+            if i >= 0 and i < self.n and j >= 0 and j < self.m-1:
+                self.horizontalWalls[i][j] = True
+            else:
+                raise ValueError('Position {}, {} is not valid for a horizontal wall'.format(i, j))
+        else:
+            raise ValueError('Type {} is not valid, only V and H allowed'.format(t))
+
+    def readChunk(self, chunk, numpy = None):
+        """
+        Add the walls of a chunk of complete lines, in bulk
+
+        Return False, possibly after adding some walls, if the chunk has to
+        be read line by line to be accepted or to report an error
+        """
+        n, m = self.n, self.m
+        if numpy is not None:
+            values = _readBulkLinesNumpy(numpy, chunk)
+            if values is None:
+                return False
+            i, j, t = values.T
+            isVertical = t == 0
+            for walls, rows, cols, select in ((self.verticalWalls, n-1, m, isVertical),
+                                              (self.horizontalWalls, n, m-1, ~isVertical)):
+                wi, wj = i[select], j[select]
+                if wi.size:
+                    if wi.min() < 0 or wi.max() >= rows or wj.min() < 0 or wj.max() >= cols:
+                        return False
+                    walls[wi, wj] = True
+            return True
+        if not _CSV_BULK_LINES.fullmatch(chunk):
+            return False
+        tokens = chunk.split()
+        verticalWalls = self.verticalWalls
+        horizontalWalls = self.horizontalWalls
+        for i, j, t in zip(map(int, tokens[0::3]), map(int, tokens[1::3]), tokens[2::3]):
+            if t == 'V':
+                if i < 0 or i >= n-1 or j < 0 or j >= m: return False
+                verticalWalls[i][j] = True
+            else:
+                if i < 0 or i >= n or j < 0 or j >= m-1: return False
+                horizontalWalls[i][j] = True
+        return True
+
+
+def _importNumpy():
+    """Return the numpy module, or None if it is not installed"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+_BULK_CHARS = b"0123456789 VH\r\n"
+_DIGITS_LIMITS = [ 10**k for k in range(1, 19) ]
+
+def _readBulkLinesNumpy(numpy, chunk):
+    """
+    Parse lines "i j T" with NumPy, as an array of rows (i, j, t) with t = 0
+    for V and 1 for H, or return None unless every line matches _CSV_BULK_LINES
+    with nonnegative numbers written without leading zeros
+    """
+    import warnings
+    if not chunk.endswith("\n"): chunk += "\n"
+    try:
+        data = chunk.encode("ascii")
+    except UnicodeEncodeError:
+        return None
+    counts = numpy.bincount(numpy.frombuffer(data, dtype = numpy.uint8), minlength = 256)
+    if counts.sum() != counts[list(_BULK_CHARS)].sum():
+        return None
+    nbLines = counts[ord("\n")]
+    if counts[ord("\r")] and data.count(b"\r\n") != counts[ord("\r")]:
+        return None
+    if counts[ord(" ")] != 2 * nbLines or counts[ord("V")] + counts[ord("H")] != nbLines:
+        return None
+    # Types become -1/-2 and line ends -3, which cannot come from the numbers
+    # as there is no sign in the chunk: each line has 3 tokens iff the values
+    # follow the pattern (i, j, T, -3); "jT" without space does not parse,
+    # so with 2 spaces per line every line is exactly "i j T".
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        try:
+            marked = data.replace(b"V", b"-1").replace(b"H", b"-2").replace(b"\r", b"").replace(b"\n", b" -3 ")
+            values = numpy.fromstring(marked, dtype = numpy.int64, sep = ' ')
+        except (DeprecationWarning, ValueError):
+            return None
+    if len(values) != 4 * nbLines:
+        return None
+    values = values.reshape(-1, 4)
+    if not ((values[:, 3] == -3).all() and (values[:, 2] <= -1).all() and (values[:, 2] >= -2).all()
+            and (values[:, :2] >= 0).all()):
+        return None
+    # Numbers too large for int64, or with leading zeros, change the length
+    digits = numpy.searchsorted(_DIGITS_LIMITS, values[:, :2], side = "right").sum() + values[:, :2].size
+    if digits + 4 * nbLines + counts[ord("\r")] != len(data):
+        return None
+    values[:, 2] = -1 - values[:, 2]
+    return values[:, :3]
+
+def wallsFromArray(numpy, array, storage):
+    """Convert a 2D NumPy boolean array to walls with the given storage"""
+    if storage == "list":
+        return array.tolist()
+    if storage == "bytes":
+        return [ bytearray(row.tobytes()) for row in array ]
+    rows, cols = array.shape
+    return PackedWalls(rows, cols, buffer = bytearray(numpy.packbits(array, axis = None, bitorder = "little").tobytes()))
+
+
+class Labyrinth2DFromBinary(Labyrinth2D):
+    """Labyrinth class created by memory-mapping a file in binary format"""
+
+    def __init__(self, filename, storage = "bits"):
+        """
+        Map 'filename' in memory and read the walls from it
+
+        With the "bits" storage, walls are read directly from the mapped
+        file; modifying them is allowed but never written back to the file.
+        Other storages copy the walls in memory.
+
+        Raise ValueError if the file does not respect the format
+        """
+        import mmap
+        with open(filename, "rb") as file:
+            try:
+                mapped = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_COPY)
+            except ValueError:
+                raise ValueError("Empty file")
+        if len(mapped) < BINARY_HEADER.size:
+            raise ValueError("File too short for a header")
+        magic, version, _, self.n, self.m = BINARY_HEADER.unpack_from(mapped)
+        if magic != BINARY_MAGIC:
+            raise ValueError("Not a binary labyrinth file")
+        if version != BINARY_VERSION:
+            raise ValueError("Unsupported binary format version {}".format(version))
+        verticalSize = ((self.n-1) * self.m + 7) // 8
+        horizontalSize = (self.n * (self.m-1) + 7) // 8
+        if len(mapped) != BINARY_HEADER.size + verticalSize + horizontalSize:
+            raise ValueError("File size {} does not match a {} x {} labyrinth".format(len(mapped), self.n, self.m))
+        self.mapped = mapped
+        view = memoryview(mapped)
+        offset = BINARY_HEADER.size
+        self.verticalWalls = self.readWalls(view[offset:offset + verticalSize], self.n-1, self.m, storage)
+        offset += verticalSize
+        self.horizontalWalls = self.readWalls(view[offset:offset + horizontalSize], self.n, self.m-1, storage)
+
+    @staticmethod
+    def readWalls(buffer, rows, cols, storage):
+        if storage == "bits":
+            return PackedWalls(rows, cols, buffer = buffer)
+        if storage not in STORAGES:
+            raise ValueError("Unknown storage {}, expected one of {}".format(storage, ", ".join(STORAGES)))
+        flags = unpackBits(buffer, rows * cols)
+        if storage == "bytes":
+            return [ flags[i * cols:(i+1) * cols] for i in range(rows) ]
+        return [ [ bool(x) for x in flags[i * cols:(i+1) * cols] ] for i in range(rows) ]
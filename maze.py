@@ -0,0 +1,162 @@
+import sys
+
+USAGE = """usage: maze.py COMMAND [ARGS...]
+       maze.py --serve
+
+Commands (see maze.py COMMAND --help):
+  generate  generate a labyrinth (solution_generate.py)
+  solve     find a shortest path (solution_shortest.py)
+  visit     visit a labyrinth (solution_visit.py)
+  analyze   check connectivity and perfection (analyze.py)
+  convert   convert a labyrinth between the CSV and binary formats
+
+--serve reads jobs from the standard input, one JSON object per line such
+as {"id": 1, "argv": ["solve", "maze.lab", "-q"]}, and writes one JSON
+result per line with the id, the exit status, the standard output and
+error of the job, and its duration in seconds. Jobs cannot read the
+standard input nor write binary data to the standard output."""
+
+# Modules of the commands, imported when the command runs
+COMMANDS = { "generate": "solution_generate", "solve": "solution_shortest",
+             "visit": "solution_visit", "analyze": "analyze" }
+
+def convert(argv = None):
+    """Command line interface of the convert command; return the exit status"""
+    import argparse
+    from labyrinth import STORAGES, loadLabyrinth
+
+    parser = argparse.ArgumentParser("Convert a labyrinth between the CSV and binary formats")
+    parser.add_argument("file", help = "input file, in CSV or binary format ('-' for standard input)")
+    parser.add_argument("output", help = "output file")
+    parser.add_argument("--to", choices = ("csv", "binary"), default = None,
+                        help = "Output format (default: csv if the output file ends with .csv, binary otherwise)")
+    parser.add_argument("--storage", choices = STORAGES, default = None,
+                        help = "Memory layout of the walls while converting (default: list for CSV, "
+                               "bits for binary files)")
+    args = parser.parse_args(argv)
+
+    binary = args.to == "binary" or args.to is None and not args.output.lower().endswith(".csv")
+    lab = loadLabyrinth(args.file, storage = args.storage)
+    if binary:
+        with open(args.output, 'wb') as out:
+            lab.saveBinary(out)
+    else:
+        with open(args.output, 'w') as out:
+            lab.saveCSV(out)
+    return 0
+
+def run(argv):
+    """Run the command line argv (without the program name); return the exit status"""
+    if not argv or argv[0] in ("-h", "--help"):
+        print(USAGE)
+        return 0 if argv else 2
+    command = argv[0]
+    if command == "convert":
+        return convert(argv[1:])
+    if command not in COMMANDS:
+        print("maze.py: unknown command {}, expected one of {}".format(
+            command, ", ".join(list(COMMANDS) + ["convert"])), file = sys.stderr)
+        return 2
+    import importlib
+    return importlib.import_module(COMMANDS[command]).main(argv[1:]) or 0
+
+class _JobInput:
+    """Standard input of a job in serve mode, which carries the jobs and cannot be read"""
+
+    def _refuse(self, *args):
+        raise ValueError("standard input carries the jobs in serve mode and cannot be read by a job")
+
+    read = readline = readlines = __iter__ = __next__ = _refuse
+
+    def fileno(self):
+        self._refuse()
+
+    def close(self):
+        pass
+
+def _jobOutput():
+    """Standard output of a job in serve mode, which cannot take binary data"""
+    import io
+
+    class JobOutput(io.StringIO):
+        @property
+        def buffer(self):
+            raise ValueError("binary output to standard output is not available in serve mode, use -o FILE")
+
+        def close(self):
+            pass
+
+    return JobOutput()
+
+def runJob(line):
+    """Result of the JSON job line, see USAGE"""
+    import io
+    import json
+    import time
+    from contextlib import redirect_stderr, redirect_stdout
+
+    result = { "id": None }
+    try:
+        job = json.loads(line)
+        result["id"] = job.get("id")
+        argv = job["argv"]
+        if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+            raise ValueError("argv should be a list of strings")
+    except (ValueError, KeyError, AttributeError) as e:
+        result.update(status = 2, stdout = "", stderr = "Invalid job: {}".format(e), seconds = 0.0)
+        return result
+    stdout, stderr = _jobOutput(), io.StringIO()
+    stdin, sys.stdin = sys.stdin, _JobInput()
+    # The command line of the job, e.g. for the reports of --profile
+    programArgv, sys.argv = sys.argv, sys.argv[:1] + argv
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                try:
+                    status = run(argv)
+                finally:
+                    # Profiling started by the job (--profile) only covers the job
+                    profiling = sys.modules.get("profiling")
+                    if profiling is not None: profiling.stop()
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                if isinstance(e.code, str): print(e.code, file = sys.stderr)
+            except Exception as e:
+                status = 1
+                print("{}: {}".format(type(e).__name__, e), file = sys.stderr)
+            # Read inside the redirection, so that nothing the job did can lose the output
+            output, errors = stdout.getvalue(), stderr.getvalue()
+    finally:
+        sys.stdin, sys.argv = stdin, programArgv
+    result.update(status = status, stdout = output, stderr = errors,
+                  seconds = time.perf_counter() - start)
+    return result
+
+def serve(jobs, out):
+    """
+    Run the JSON jobs of the lines of jobs, writing their results to out
+
+    The modules imported by a job stay loaded for the next ones. Jobs
+    should not display visits (-q); they cannot read the standard input
+    (labyrinth file, --batch or --matrix '-') nor write binary data to the
+    standard output. A job that fails only gets a non-zero status. The
+    report of --profile covers its job only, and is saved when it ends.
+    """
+    import json
+    for line in jobs:
+        if not line.strip(): continue
+        try:
+            result = runJob(line)
+        except Exception as e:
+            result = { "id": None, "status": 1, "stdout": "", "seconds": 0.0,
+                       "stderr": "{}: {}".format(type(e).__name__, e) }
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--serve"]:
+        serve(sys.stdin, sys.stdout)
+        sys.exit(0)
+    sys.exit(run(sys.argv[1:]))
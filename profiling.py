@@ -0,0 +1,316 @@
+import atexit
+import json
+import sys
+import time
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# Phases of a run, in the order of the report
+PHASES = ("parse", "build", "solve", "render")
+
+class Profile:
+    """
+    Counters and phase timings of a run
+
+    Nothing is instrumented until enable(), which wraps the methods and
+    module globals of the hot paths (see instrument); disable() puts the
+    originals back, so a run without profiling executes the same code as
+    before.
+
+    Phases are exclusive: time spent in a phase entered from another one
+    (e.g. building the adjacency while solving) only counts for the inner
+    phase. Time outside any phase is reported as "other".
+
+    Counters:
+      neighborCalls: neighbor lists read: calls to Labyrinth2D.neighbors,
+                     Adjacency.neighborIds and HeadlessVisit.currentNeighbors,
+                     and slices of the CSR arrays by fastShortestPath
+      cellsExpanded: cells whose neighbors are explored by the searches of
+                     solution_shortest (BFS frontiers, A* heap, the list of
+                     shortestPath)
+      wallChecks:    walls looked up: the inner sides of the cell for each
+                     neighbor list computed from the walls or the direction
+                     masks (not from the CSR arrays), and one per moveTo
+      moves:         moves accepted by moveTo
+      revisits:      accepted moves to an already visited cell
+    Visit engines that do not go through moveTo (fastPlanarVisit without
+    display, the analytic wall followers, the vectorized random walks) do
+    not count moves.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self._stack = []
+        self._since = None
+        self._patches = []
+        self._profiler = None
+        self.started = None
+        self.seconds = None
+
+    def enable(self, cprofile = False):
+        """Instrument the hot paths, and run cProfile too if cprofile is True"""
+        instrument(self)
+        self.started = time.perf_counter()
+        if cprofile:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def disable(self):
+        """Remove the instrumentation"""
+        if self._profiler is not None:
+            self._profiler.disable()
+        while self._stack:
+            self.leave()
+        if self.started is not None:
+            self.seconds = time.perf_counter() - self.started
+        while self._patches:
+            owner, name, original = self._patches.pop()
+            setattr(owner, name, original)
+
+    def patch(self, owner, name, wrapper):
+        """Replace the attribute name of owner by wrapper(original) until disable()"""
+        original = owner.__dict__[name] if isinstance(owner, type) else getattr(owner, name)
+        self._patches.append((owner, name, original))
+        setattr(owner, name, wrapper(original))
+
+    def enter(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self.phases[self._stack[-1]] += now - self._since
+        self._stack.append(name)
+        self._since = now
+
+    def leave(self):
+        now = time.perf_counter()
+        name = self._stack.pop()
+        self.phases[name] = self.phases.get(name, 0.0) + now - self._since
+        self._since = now
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager timing a phase"""
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def timed(self, name):
+        """Decorator timing the calls of a function as the phase name"""
+        def wrapper(function):
+            @wraps(function)
+            def timedFunction(*args, **kwargs):
+                self.enter(name)
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.leave()
+            return timedFunction
+        return wrapper
+
+    def counted(self, name):
+        """Decorator counting the calls of a function in the counter name"""
+        counters = self.counters
+        def wrapper(function):
+            @wraps(function)
+            def countedFunction(*args, **kwargs):
+                counters[name] += 1
+                return function(*args, **kwargs)
+            return countedFunction
+        return wrapper
+
+    def report(self, top = 25):
+        """
+        Machine-readable report: total and phase times in seconds, counters,
+        and with cProfile the top functions by cumulative time
+        """
+        seconds = self.seconds if self.seconds is not None else time.perf_counter() - self.started
+        phases = dict(self.phases)
+        phases["other"] = max(0.0, seconds - sum(phases.values()))
+        result = { "command": sys.argv, "seconds": seconds, "phases": phases,
+                   "counters": dict(self.counters) }
+        if self._profiler is not None:
+            import pstats
+            stats = pstats.Stats(self._profiler).stats
+            functions = sorted(stats.items(), key = lambda item: -item[1][3])[:top]
+            result["functions"] = [ { "function": "{}:{}({})".format(*key), "calls": nc,
+                                      "tottime": tt, "cumtime": ct }
+                                    for key, (cc, nc, tt, ct, callers) in functions ]
+        return result
+
+    def dumpStats(self, filename):
+        """Save the raw cProfile statistics, readable with pstats"""
+        self._profiler.dump_stats(filename)
+
+
+def _loadedModules(name):
+    """The module name, and __main__ if it is the same file run as a script"""
+    main = sys.modules.get("__main__")
+    modules = [ sys.modules[name] ]
+    path = getattr(main, "__file__", None) or ""
+    if main is not None and path.replace("\\", "/").rsplit("/", 1)[-1] == name + ".py":
+        modules.append(main)
+    return modules
+
+def instrument(profile):
+    """Wrap the hot paths of the labyrinth tools to update profile"""
+    import labyrinth
+    import visit
+    import solution_shortest
+    import solution_visit
+    from treeindex import TreeIndex
+    counters = profile.counters
+
+    for cls in (labyrinth.Labyrinth2DFromFile, labyrinth.Labyrinth2DFromBinary):
+        profile.patch(cls, "__init__", profile.timed("parse"))
+    for owner, name in ((labyrinth.Labyrinth2D, "compileAdjacency"), (TreeIndex, "__init__")):
+        profile.patch(owner, name, profile.timed("build"))
+    def timedCSR(csr):
+        # Only time the builds, csr() being called for every neighborIds()
+        @wraps(csr)
+        def buildCSR(self):
+            if self._csr is not None:
+                return csr(self)
+            with profile.phase("build"):
+                return csr(self)
+        return buildCSR
+    profile.patch(labyrinth.Adjacency, "csr", timedCSR)
+    for module in _loadedModules("solution_visit"):
+        profile.patch(module, "rootedTree", profile.timed("build"))
+    for owner, name in ((labyrinth.Labyrinth2D, "draw"), (labyrinth.Labyrinth2D, "printCompact"),
+                        (labyrinth.Labyrinth2D, "printWide"), (visit.Visit, "printWideVisited")):
+        profile.patch(owner, name, profile.timed("render"))
+    def timedDisplay(method):
+        # Observers without display only do bookkeeping, left in the current phase
+        timedMethod = profile.timed("render")(method)
+        @wraps(method)
+        def observerMethod(self, *args):
+            return (timedMethod if self.display else method)(self, *args)
+        return observerMethod
+    for cls in (visit.TerminalObserver, visit.AnsiObserver):
+        for name in ("started", "moved", "finished"):
+            profile.patch(cls, name, timedDisplay)
+
+    def wallNeighbors(position):
+        # Neighbor lists computed from the walls or the masks look up every inner side of the cell
+        def wrapper(neighbors):
+            @wraps(neighbors)
+            def countedNeighbors(self, *args):
+                i, j = position(self, *args)
+                counters["neighborCalls"] += 1
+                counters["wallChecks"] += (i > 0) + (j > 0) + (i < self.n - 1) + (j < self.m - 1)
+                return neighbors(self, *args)
+            return countedNeighbors
+        return wrapper
+    profile.patch(labyrinth.Labyrinth2D, "neighbors", wallNeighbors(lambda self, pos: pos))
+    profile.patch(visit.HeadlessVisit, "currentNeighbors", wallNeighbors(lambda self: self.currentPosition))
+    profile.patch(labyrinth.Adjacency, "neighborIds", profile.counted("neighborCalls"))
+
+    def checkedMove(moveTo):
+        @wraps(moveTo)
+        def countedMoveTo(self, nextPosition):
+            u, v = nextPosition
+            seen = 0 <= u < self.n and 0 <= v < self.m and self.visited[u][v]
+            counters["wallChecks"] += 1
+            moveTo(self, nextPosition)
+            counters["moves"] += 1
+            if seen: counters["revisits"] += 1
+        return countedMoveTo
+    for cls in (visit.Visit, visit.HeadlessVisit):
+        profile.patch(cls, "moveTo", checkedMove)
+
+    class CountingDeque(deque):
+        def popleft(self):
+            counters["cellsExpanded"] += 1
+            return deque.popleft(self)
+    def countingHeapq(heapq):
+        class CountingHeapq:
+            heappush = staticmethod(heapq.heappush)
+            heapify = staticmethod(heapq.heapify)
+            @staticmethod
+            def heappop(heap):
+                counters["cellsExpanded"] += 1
+                return heapq.heappop(heap)
+        return CountingHeapq
+    def sameCount(counted, name):
+        # For searches reading exactly one neighbor list per expanded cell
+        def wrapper(search):
+            @wraps(search)
+            def countedSearch(*args, **kwargs):
+                before = counters[counted]
+                try:
+                    return search(*args, **kwargs)
+                finally:
+                    counters[name] += counters[counted] - before
+            return countedSearch
+        return wrapper
+    for module in _loadedModules("solution_shortest"):
+        profile.patch(module, "deque", lambda original: CountingDeque)
+        profile.patch(module, "heapq", countingHeapq)
+        # fastShortestPath slices the CSR arrays instead of calling neighborIds
+        profile.patch(module, "fastShortestPath", sameCount("cellsExpanded", "neighborCalls"))
+        # shortestPath pops its frontier from a list
+        profile.patch(module, "shortestPath", sameCount("neighborCalls", "cellsExpanded"))
+
+
+_active = None
+_save = None
+
+def active():
+    """The Profile of the run, None if profiling is disabled"""
+    return _active
+
+def phase(name):
+    """Context manager timing the phase name of the active Profile, if any"""
+    if _active is None:
+        return nullcontext()
+    return _active.phase(name)
+
+def start(filename, cprofile = None, phase = None):
+    """
+    Profile the rest of the run, and save the JSON report to filename
+    ('-' for the standard error) on stop(), or when the interpreter exits
+
+    cprofile, if given, is a file where the cProfile statistics are saved;
+    the report then also lists the top functions by cumulative time.
+    phase, if given, is entered until the end of the run, so that the time
+    outside the other phases is reported there. A run already profiled is
+    stopped first.
+    """
+    global _active, _save
+    stop()
+    profile = Profile()
+    profile.enable(cprofile = cprofile is not None)
+    if phase is not None:
+        profile.enter(phase)
+
+    def save():
+        if cprofile is not None:
+            profile.dumpStats(cprofile)
+        report = profile.report()
+        if filename == "-":
+            json.dump(report, sys.stderr, indent = 1)
+            sys.stderr.write("\n")
+        else:
+            with open(filename, 'w') as out:
+                json.dump(report, out, indent = 1)
+    _active, _save = profile, save
+    atexit.register(stop)
+    return profile
+
+def stop():
+    """
+    Remove the instrumentation of the profiled run, if any, and save its
+    report (e.g. at the end of a job of maze.py --serve)
+    """
+    global _active, _save
+    if _active is None:
+        return
+    profile, save = _active, _save
+    _active = _save = None
+    atexit.unregister(stop)
+    profile.disable()
+    save()
@@ -0,0 +1,142 @@
+import struct
+import zlib
+from collections import defaultdict
+
+# Pixels are palette indices: white background, black walls, red path
+WHITE, BLACK, RED = 0, 1, 2
+PALETTE = (b"\xff\xff\xff", b"\x00\x00\x00", b"\xff\x00\x00")
+RASTER_FORMATS = { ".png": "png", ".ppm": "ppm", ".pnm": "ppm" }
+
+def imageSize(lab, cell_size = 40, margin = 10):
+    """(width, height) in pixels of the image of lab"""
+    return 2 * margin + cell_size * lab.n, 2 * margin + cell_size * lab.m
+
+def rasterRows(lab, path = None, cell_size = 40, margin = 10, start = (0, 0)):
+    """
+    Iterate over the pixel rows of the image of lab, as Labyrinth2D.draw
+    draws it with wand, as bytearrays of palette indices
+
+    Walls and path segments are 3 pixels wide lines. Only the walls of the
+    cell rows next to the current pixel row are read, so memory is
+    proportional to the width of the image and to the length of the path.
+    """
+    n, m = lab.n, lab.m
+    width, height = imageSize(lab, cell_size, margin)
+    # Path segments by cell row: horizontal spans at the center of row j,
+    # and columns of the vertical segments from row j to row j+1
+    half = cell_size // 2
+    spans = defaultdict(list)
+    columns = defaultdict(list)
+    if path:
+        (i, j) = start
+        for (u, v) in path:
+            if v == j and u != i:
+                spans[j].append((margin + min(i, u) * cell_size + half - 1, margin + max(i, u) * cell_size + half + 2))
+            elif u == i and v != j:
+                columns[min(j, v)].append(margin + i * cell_size + half)
+            i, j = u, v
+
+    def clipped(row):
+        return row[1:width + 1]
+
+    def wallRow(j):
+        # Vertical walls (and left and right borders) crossing cell row j, as an int of 0/1 bytes
+        row = bytearray(width + 2)
+        verticalWalls = lab.verticalWalls
+        for i in range(-1, n):
+            if i < 0 or i == n - 1 or verticalWalls[i][j]:
+                x = margin + (i + 1) * cell_size
+                row[x:x + 3] = b"\x01\x01\x01"
+        return int.from_bytes(clipped(row), "little")
+
+    def lineRow(k):
+        # Horizontal walls (or border) above cell row k, as an int of 0/1 bytes
+        row = bytearray(width + 2)
+        horizontalWalls = lab.horizontalWalls
+        for i in range(n):
+            if k == 0 or k == m or horizontalWalls[i][k - 1]:
+                x = margin + i * cell_size
+                row[x:x + cell_size + 3] = b"\x01" * (cell_size + 3)
+        return int.from_bytes(clipped(row), "little")
+
+    walls = {}
+    lines = {}
+    previousKey = None
+    row = None
+    center = margin + half
+    for y in range(height):
+        # Cell rows whose vertical walls, walls above, and path segments cover y
+        wallBands = tuple(j for j in range(max(0, (y - margin - 1) // cell_size - 1), min(m, (y - margin + 1) // cell_size + 1))
+                          if margin + j * cell_size - 1 <= y <= margin + (j + 1) * cell_size + 1)
+        lineBands = tuple(k for k in range(max(0, (y - margin - 1) // cell_size), min(m, (y - margin + 1) // cell_size) + 1)
+                          if abs(y - margin - k * cell_size) <= 1)
+        spanBands = tuple(j for j in range(max(0, (y - center - 1) // cell_size), min(m, (y - center + 1) // cell_size + 1))
+                          if abs(y - center - j * cell_size) <= 1 and j in spans)
+        columnBands = tuple(j for j in range(max(0, (y - center - cell_size - 1) // cell_size), min(m, (y - center + 1) // cell_size + 1))
+                            if center + j * cell_size - 1 <= y <= center + (j + 1) * cell_size + 1 and j in columns)
+        key = (wallBands, lineBands, spanBands, columnBands)
+        if key != previousKey:
+            previousKey = key
+            if wallBands and wallBands[0] - 1 in walls: del walls[wallBands[0] - 1]
+            if lineBands and lineBands[0] - 1 in lines: del lines[lineBands[0] - 1]
+            pixels = 0
+            for j in wallBands:
+                if j not in walls: walls[j] = wallRow(j)
+                pixels |= walls[j]
+            for k in lineBands:
+                if k not in lines: lines[k] = lineRow(k)
+                pixels |= lines[k]
+            row = bytearray(pixels.to_bytes(width, "little"))
+            for j in spanBands:
+                for x0, x1 in spans[j]:
+                    row[max(x0, 0):x1] = b"\x02" * (x1 - max(x0, 0))
+            for j in columnBands:
+                for x in columns[j]:
+                    row[max(x - 1, 0):x + 2] = b"\x02" * (x + 2 - max(x - 1, 0))
+            del row[width:]
+        yield row
+
+def _pngChunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+def writePNG(file, width, height, rows, palette = PALETTE):
+    """Write an 8-bit palette PNG image to file (opened in binary mode), compressed row by row"""
+    file.write(b"\x89PNG\r\n\x1a\n")
+    file.write(_pngChunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)))
+    file.write(_pngChunk(b"PLTE", b"".join(palette)))
+    compressor = zlib.compressobj(6)
+    data = []
+    size = 0
+    for row in rows:
+        compressed = compressor.compress(b"\x00" + row)
+        if compressed:
+            data.append(compressed)
+            size += len(compressed)
+            if size >= 1 << 20:
+                file.write(_pngChunk(b"IDAT", b"".join(data)))
+                data = []
+                size = 0
+    data.append(compressor.flush())
+    file.write(_pngChunk(b"IDAT", b"".join(data)))
+    file.write(_pngChunk(b"IEND", b""))
+
+def writePPM(file, width, height, rows, palette = PALETTE):
+    """Write a binary PPM (P6) image to file (opened in binary mode)"""
+    file.write("P6\n{} {}\n255\n".format(width, height).encode())
+    channels = [ bytes(color[c] for color in palette).ljust(256, b"\x00") for c in range(3) ]
+    for row in rows:
+        rgb = bytearray(3 * width)
+        for c in range(3):
+            rgb[c::3] = row.translate(channels[c])
+        file.write(rgb)
+
+def drawRaster(lab, filename, path = None, cell_size = 40, margin = 10, start = (0, 0)):
+    """Draw lab and path to filename, in PNG or PPM format depending on its extension"""
+    import os
+    kind = RASTER_FORMATS.get(os.path.splitext(filename)[1].lower())
+    if kind is None:
+        raise ValueError("Unknown image format for {}, expected one of {}".format(filename, ", ".join(RASTER_FORMATS)))
+    width, height = imageSize(lab, cell_size, margin)
+    rows = rasterRows(lab, path, cell_size, margin, start)
+    with open(filename, "wb") as file:
+        (writePNG if kind == "png" else writePPM)(file, width, height, rows)
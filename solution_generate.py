@@ -1,5 +1,8 @@
 import labyrinth
 import random
+from array import array
+
+ENGINES = ("array", "dict", "slow")
 
 class Components:
     def __init__(self, values):
@@ -47,17 +50,152 @@ class SlowComponents(Components):
             y = self.dict[y]
         return x
     
-    
+
+class ArrayComponents:
+    """
+    Union-find over the integers 0..size-1 (cell (i, j) has id i*m + j)
+
+    Stored in flat arrays, with path halving and union by rank
+    """
+    def __init__(self, size):
+        self.parent = array(indexTypeCode(size), range(size))
+        self.rank = bytearray(size)
+
+    def getRepresentative(self, x):
+        parent = self.parent
+        y = parent[x]
+        while y != x:
+            z = parent[y]
+            parent[x] = z
+            x = y
+            y = z
+        return x
+
+    def connect(self, x, y):
+        connected = self.connectIfPossible(x, y)
+        assert connected
+
+    def areConnected(self, x, y):
+        return self.getRepresentative(x) == self.getRepresentative(y)
+
+    def connectIfPossible(self, x, y):
+        rx = self.getRepresentative(x)
+        ry = self.getRepresentative(y)
+        if rx == ry:
+            return False
+        rank = self.rank
+        if rank[rx] < rank[ry]:
+            self.parent[rx] = ry
+        elif rank[rx] > rank[ry]:
+            self.parent[ry] = rx
+        else:
+            self.parent[ry] = rx
+            rank[rx] += 1
+        return True
+
+
+def indexTypeCode(size):
+    """array type code able to store integers up to size"""
+    return 'i' if size < 2**31 else 'q'
+
+def shuffledRange(size, rng = random):
+    """Yield the integers 0..size-1 in random order, shuffling lazily (Fisher-Yates)"""
+    perm = array(indexTypeCode(size), range(size))
+    rand = rng.random
+    for k in range(size):
+        r = k + int(rand() * (size - k))
+        x = perm[r]
+        perm[r] = perm[k]
+        yield x
+
+def ellerRows(n, m, rng = random):
+    """
+    Generate a random perfect labyrinth strip by strip with Eller's algorithm
+
+    Yield (i, horizontal, vertical) for i in 0..n-1, where horizontal[j] is
+    True iff there is a wall between (i, j) and (i, j+1), and vertical[j] is
+    True iff there is a wall between (i, j) and (i+1, j) (None for the last
+    strip). Only the set labels of the current strip are kept, so memory is
+    O(m) whatever n.
+    """
+    rand = rng.random
+    sets = list(range(m))   # labels are always < 2*m
+    for i in range(n):
+        last = i == n-1
+        parent = list(range(2 * m))
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        horizontal = bytearray(b'\x01') * (m-1)
+        for j in range(m-1):
+            a = find(sets[j])
+            b = find(sets[j+1])
+            if a != b and (last or rand() < 0.5):
+                horizontal[j] = 0
+                parent[b] = a
+        sets = [ find(x) for x in sets ]
+        if last:
+            yield i, horizontal, None
+            return
+
+        # Each set goes down at least once, at its last cell if no other did
+        remaining = {}
+        for x in sets:
+            remaining[x] = remaining.get(x, 0) + 1
+        goesDown = set()
+        vertical = bytearray(b'\x01') * m
+        for j, x in enumerate(sets):
+            remaining[x] -= 1
+            if rand() < 0.5 or (remaining[x] == 0 and x not in goesDown):
+                vertical[j] = 0
+                goesDown.add(x)
+        yield i, horizontal, vertical
+
+        relabel = {}
+        for j, x in enumerate(sets):
+            sets[j] = relabel.setdefault(x, len(relabel)) if not vertical[j] else -1
+        fresh = len(relabel)
+        for j, x in enumerate(sets):
+            if x < 0:
+                sets[j] = fresh
+                fresh += 1
+
 
 class GenerateLabyrinth2D(labyrinth.Labyrinth2D):
-    def __init__(self, n, m, slow = False):
+    def __init__(self, n, m, slow = False, storage = "list", engine = "array", algo = "kruskal"):
+        """
+        Generate a random perfect labyrinth with the algorithm 'algo' (see GENERATORS)
+
+        engine selects the union-find structure used by Kruskal's algorithm:
+        "array" (flat arrays indexed by cell id), "dict" (Components) or
+        "slow" (SlowComponents)
+        """
+        if slow: engine = "slow"
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine {}, expected one of {}".format(engine, ", ".join(ENGINES)))
+        if algo not in GENERATORS:
+            raise ValueError("Unknown algorithm {}, expected one of {}".format(algo, ", ".join(GENERATORS)))
         self.n = n
         self.m = m
-        self.verticalWalls = [ [True] * m for i in range(n-1) ]
+        full = algo != "division"
+        self.verticalWalls = labyrinth.makeWalls(n-1, m, full, storage)
            # verticalWalls[i][j] is True iff there is a wall between (i, j) and (i+1, j)
-        self.horizontalWalls = [ [True] * (m-1) for i in range(n) ]
+        self.horizontalWalls = labyrinth.makeWalls(n, m-1, full, storage)
            # horizontalWalls[i][j] is True iff there is a wall between (i, j) and (i, j+1)
 
+        if algo == "kruskal":
+            self.kruskal(engine)
+        else:
+            GENERATORS[algo](self)
+
+    def kruskal(self, engine = "array"):
+        """Randomized Kruskal's algorithm"""
+        if engine == "array":
+            self.kruskalArray()
+            return
 
         nodes = self.allNodes()
         edges = self.possibleEdges()
@@ -76,7 +214,7 @@ class GenerateLabyrinth2D(labyrinth.Labyrinth2D):
         # edges = part1 + part2
         random.shuffle(edges)
         
-        if slow:
+        if engine == "slow":
             comp = SlowComponents(nodes)
         else: 
             comp = Components(nodes)
@@ -89,7 +227,121 @@ class GenerateLabyrinth2D(labyrinth.Labyrinth2D):
                 nbComps -= 1
                 self.removeWall(i, j, isVertical)
                 if nbComps == 1: break
-           
+
+    def kruskalArray(self):
+        """Kruskal's algorithm on integer cell ids, without building node or edge lists"""
+        n, m = self.n, self.m
+        # Edge e < nbVertical is the vertical wall (e // m, e % m),
+        # the others are horizontal walls in the same row-major order
+        nbVertical = (n-1) * m
+        nbComps = n * m
+        if nbComps == 1: return
+        connectIfPossible = ArrayComponents(nbComps).connectIfPossible
+        removeWall = self.removeWall
+        for e in shuffledRange(nbVertical + n * (m-1)):
+            isVertical = e < nbVertical
+            if isVertical:
+                a = e
+                b = e + m
+            else:
+                i, j = divmod(e - nbVertical, m-1)
+                a = i * m + j
+                b = a + 1
+            if connectIfPossible(a, b):
+                nbComps -= 1
+                i, j = divmod(a, m)
+                removeWall(i, j, isVertical)
+                if nbComps == 1: break
+
+    def recursiveBacktracker(self):
+        """Randomized depth-first search, with an explicit stack of cell ids"""
+        n, m = self.n, self.m
+        visited = bytearray(n * m)
+        stack = array(indexTypeCode(n * m), [0])
+        visited[0] = 1
+        choice = random.choice
+        while stack:
+            c = stack[-1]
+            i, j = divmod(c, m)
+            candidates = []
+            if i > 0 and not visited[c - m]: candidates.append(c - m)
+            if j > 0 and not visited[c - 1]: candidates.append(c - 1)
+            if i < n-1 and not visited[c + m]: candidates.append(c + m)
+            if j < m-1 and not visited[c + 1]: candidates.append(c + 1)
+            if not candidates:
+                stack.pop()
+                continue
+            d = choice(candidates)
+            self.removeWallBetween(c, d)
+            visited[d] = 1
+            stack.append(d)
+
+    def wilson(self):
+        """Wilson's algorithm: uniform spanning tree from loop-erased random walks"""
+        n, m = self.n, self.m
+        size = n * m
+        inTree = bytearray(size)
+        inTree[random.randrange(size)] = 1
+        nextCell = array(indexTypeCode(size), [0]) * size
+        choice = random.choice
+        for start in range(size):
+            if inTree[start]: continue
+            # Random walk until the tree is hit, remembering the last exit of each
+            # cell: following nextCell from start then gives the loop-erased walk
+            c = start
+            while not inTree[c]:
+                i, j = divmod(c, m)
+                candidates = []
+                if i > 0: candidates.append(c - m)
+                if j > 0: candidates.append(c - 1)
+                if i < n-1: candidates.append(c + m)
+                if j < m-1: candidates.append(c + 1)
+                d = choice(candidates)
+                nextCell[c] = d
+                c = d
+            c = start
+            while not inTree[c]:
+                inTree[c] = 1
+                self.removeWallBetween(c, nextCell[c])
+                c = nextCell[c]
+
+    def eller(self):
+        """Eller's algorithm, see ellerRows"""
+        for i, horizontal, vertical in ellerRows(self.n, self.m):
+            for j, wall in enumerate(horizontal):
+                if not wall: self.removeWall(i, j, False)
+            if vertical is not None:
+                for j, wall in enumerate(vertical):
+                    if not wall: self.removeWall(i, j, True)
+
+    def recursiveDivision(self):
+        """Recursive division: starting without walls, split regions with a wall having one gap"""
+        regions = [ (0, 0, self.n, self.m) ]
+        while regions:
+            i0, j0, width, height = regions.pop()
+            if width < 2 or height < 2: continue
+            if width > height or (width == height and random.getrandbits(1)):
+                # Vertical walls between columns k and k+1
+                k = i0 + random.randrange(width - 1)
+                gap = j0 + random.randrange(height)
+                for j in range(j0, j0 + height):
+                    if j != gap: self.verticalWalls[k][j] = True
+                regions.append((i0, j0, k + 1 - i0, height))
+                regions.append((k + 1, j0, i0 + width - k - 1, height))
+            else:
+                # Horizontal walls between rows k and k+1
+                k = j0 + random.randrange(height - 1)
+                gap = i0 + random.randrange(width)
+                for i in range(i0, i0 + width):
+                    if i != gap: self.horizontalWalls[i][k] = True
+                regions.append((i0, j0, width, k + 1 - j0))
+                regions.append((i0, k + 1, width, j0 + height - k - 1))
+
+    def removeWallBetween(self, a, b):
+        """Remove the wall between the neighboring cells of ids a and b"""
+        if a > b: a, b = b, a
+        i, j = divmod(a, self.m)
+        self.removeWall(i, j, b == a + self.m)
 
     # List of possible edges as (i, j, isVertical)
     def possibleEdges(self):
@@ -99,13 +351,6 @@ class GenerateLabyrinth2D(labyrinth.Labyrinth2D):
     def allNodes(self):
         return [ (i, j) for i in range(self.n) for j in range(self.m) ]
 
-    def removeWall(self, i, j, isVertical):
-        if isVertical: 
-            self.verticalWalls[i][j] = False
-        else: 
-            self.horizontalWalls[i][j] = False
-
-
     def removeRandomWalls(self, nb):
         found = 0
         while found < nb:
@@ -113,42 +358,176 @@ class GenerateLabyrinth2D(labyrinth.Labyrinth2D):
                 i = random.randrange(self.n - 1)
                 j = random.randrange(self.m)
                 if self.verticalWalls[i][j]:
-                    self.verticalWalls[i][j] = False
+                    self.removeWall(i, j, True)
                     found += 1
             else: 
                 i = random.randrange(self.n)
                 j = random.randrange(self.m - 1)
                 if self.horizontalWalls[i][j]:
-                    self.horizontalWalls[i][j] = False
+                    self.removeWall(i, j, False)
                     found += 1
     
 
+GENERATORS = {
+    "kruskal": GenerateLabyrinth2D.kruskal,
+    "backtracker": GenerateLabyrinth2D.recursiveBacktracker,
+    "wilson": GenerateLabyrinth2D.wilson,
+    "eller": GenerateLabyrinth2D.eller,
+    "division": GenerateLabyrinth2D.recursiveDivision,
+}
+
+
+# Corpus directories hold one binary file per labyrinth, and this index
+CORPUS_INDEX = "index.csv"
+CORPUS_FIELDS = ("id", "file", "n", "m", "algo", "walls", "seed")
+
+def _generateCorpusEntry(task):
+    """Generate and save one labyrinth of a corpus, return its index row"""
+    import os
+    directory, k, n, m, algo, walls, seed, filename = task
+    # Each labyrinth has its own seed, whatever the process generating it
+    random.seed("{}:{}".format(seed, k))
+    lab = GenerateLabyrinth2D(n, m, algo = algo)
+    if walls:
+        lab.removeRandomWalls(walls)
+    with open(os.path.join(directory, filename), 'wb') as out:
+        lab.saveBinary(out)
+    return (k, filename, n, m, algo, walls, seed)
+
+def generateCorpus(directory, count, sizes, algo = "kruskal", walls = 0, seed = 0, workers = None):
+    """
+    Generate 'count' labyrinths in directory, in binary format, with
+    'workers' processes (default: one per CPU)
+
+    Labyrinth k has size sizes[k % len(sizes)] (pairs (n, m)), is generated
+    with random.seed("seed:k"), then has 'walls' random walls removed. The
+    files are listed in the CSV file CORPUS_INDEX of directory, written as
+    the labyrinths are generated; see readCorpusIndex.
+    """
+    import csv
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    os.makedirs(directory, exist_ok = True)
+    digits = len(str(max(count - 1, 0)))
+    tasks = ( (directory, k, sizes[k % len(sizes)][0], sizes[k % len(sizes)][1], algo, walls, seed,
+               "maze-{:0{}d}.lab".format(k, digits)) for k in range(count) )
+    if workers is None: workers = os.cpu_count() or 1
+    with open(os.path.join(directory, CORPUS_INDEX), 'w', newline = '') as index:
+        writer = csv.writer(index)
+        writer.writerow(CORPUS_FIELDS)
+        if workers == 1:
+            for task in tasks:
+                writer.writerow(_generateCorpusEntry(task))
+            return
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            chunkSize = max(1, min(64, count // (4 * workers)))
+            for row in executor.map(_generateCorpusEntry, tasks, chunksize = chunkSize):
+                writer.writerow(row)
+
+def readCorpusIndex(directory):
+    """
+    Entries of the corpus in directory, as dicts with the keys of
+    CORPUS_FIELDS; labyrinth.loadLabyrinth(os.path.join(directory,
+    entry["file"])) loads one of them
+    """
+    import csv
+    import os
+    with open(os.path.join(directory, CORPUS_INDEX), newline = '') as index:
+        entries = list(csv.DictReader(index))
+    for entry in entries:
+        for key in ("id", "n", "m", "walls", "seed"):
+            entry[key] = int(entry[key])
+    return entries
+
+def parseSize(text):
+    """Size "NxM" as a pair of integers"""
+    n, _, m = text.partition("x")
+    return int(n), int(m)
+
             
-if __name__ == "__main__":
+def main(argv = None):
+    """Command line interface; argv defaults to sys.argv[1:], return the exit status"""
     import sys
     import argparse
+    from contextlib import nullcontext
 
     parser = argparse.ArgumentParser("Generate a labyrinth of given size")
     parser.add_argument("n", type = int, help = "Number of columns of the labyrinth")
     parser.add_argument("m", type = int, help = "Number of rows of the labyrinth")
-    parser.add_argument("-o", dest = "file", type = argparse.FileType('w'),
-                        help = "File to save the result", default = sys.stdout)
+    parser.add_argument("-o", dest = "file", default = None,
+                        help = "File to save the result (default: standard output)")
+    parser.add_argument("-b", "--binary", action = "store_true",
+                        help = "Save the result in binary format instead of CSV")
     parser.add_argument("--slow", action = "store_true",
                         help = "Use the slow algorithm for checking connected components")
+    parser.add_argument("--engine", choices = ENGINES, default = "array",
+                        help = "Union-find used for checking connected components (default: array)")
+    parser.add_argument("--algo", choices = GENERATORS, default = None,
+                        help = "Generation algorithm (default: kruskal, or eller with --stream)")
+    parser.add_argument("--stream", action = "store_true",
+                        help = "Write the labyrinth while it is generated with Eller's algorithm, "
+                               "using memory for one row only")
     parser.add_argument("-s", "--show", action = "store_true",
                         help = "Show the result in compact form")
     parser.add_argument("-d", "--draw", default = None,
                         help = "Draw the result in an image with this filename")
+    parser.add_argument("--cell-size", type = int, default = 40,
+                        help = "Size of the cells in pixels when drawing (default: 40)")
     parser.add_argument("-r", dest = "random", metavar = "X", type = int, default = 0,
                         help = "Remove X random walls from the labyrinth")
+    parser.add_argument("--storage", choices = labyrinth.STORAGES, default = "list",
+                        help = "Memory layout of the walls (bytes: 1 byte per wall, bits: 1 bit per wall)")
+    parser.add_argument("--corpus", metavar = "DIR", default = None,
+                        help = "Generate --count labyrinths in binary format in the directory DIR, "
+                               "listed in DIR/{}".format(CORPUS_INDEX))
+    parser.add_argument("--count", type = int, default = 1,
+                        help = "Number of labyrinths of the corpus (default: 1)")
+    parser.add_argument("--sizes", metavar = "NxM", type = parseSize, nargs = "+", default = None,
+                        help = "Sizes of the labyrinths of the corpus, used in turn (default: n x m)")
+    parser.add_argument("--seed", type = int, default = 0,
+                        help = "Seed of the corpus, labyrinth k uses the seed \"SEED:k\" (default: 0)")
+    parser.add_argument("-j", "--workers", type = int, default = 0,
+                        help = "Number of processes generating the corpus (default: one per CPU)")
+
+    args = parser.parse_args(argv)
 
-    args = parser.parse_args()
+    if args.corpus:
+        if args.stream or args.show or args.draw or args.file:
+            parser.error("--corpus cannot be used with --stream, --show, --draw or -o")
+        generateCorpus(args.corpus, args.count, args.sizes or [(args.n, args.m)],
+                       algo = args.algo or "kruskal", walls = args.random, seed = args.seed,
+                       workers = args.workers or None)
+        return 0
+
+    if args.stream:
+        if args.algo not in (None, "eller"):
+            parser.error("--stream only works with --algo eller")
+        if args.random or args.show or args.draw or args.binary:
+            parser.error("--stream cannot be used with -r, --show, --draw or --binary")
+        with open(args.file, 'w') if args.file else nullcontext(sys.stdout) as out:
+            labyrinth.writeStripsCSV(out, args.n, args.m, ellerRows(args.n, args.m))
+        return 0
+    if args.algo is None:
+        args.algo = "kruskal"
     
-    lab = GenerateLabyrinth2D(args.n, args.m, slow = args.slow)
+    lab = GenerateLabyrinth2D(args.n, args.m, slow = args.slow, storage = args.storage,
+                              engine = args.engine, algo = args.algo)
     if args.random:
         lab.removeRandomWalls(args.random)
     if args.show:
         lab.printCompact()
     if args.draw:
-        lab.draw(args.draw)
-    lab.saveCSV(args.file)
+        lab.draw(args.draw, cell_size = args.cell_size)
+    if args.binary:
+        with open(args.file, 'wb') if args.file else nullcontext(sys.stdout.buffer) as out:
+            lab.saveBinary(out)
+    else:
+        with open(args.file, 'w') if args.file else nullcontext(sys.stdout) as out:
+            lab.saveCSV(out)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
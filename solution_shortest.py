@@ -1,3 +1,8 @@
+import heapq
+from array import array
+from collections import OrderedDict, deque
+
+METHODS = ("bfs", "bidir", "astar")
 
 def shortestPath(lab):
     startingPoint = (0, 0)
@@ -30,28 +35,504 @@ def shortestPath(lab):
     return path, isPerfect
 
 
-if __name__ == "__main__":
-    from labyrinth import *
-    from visit import Visit
+def fastShortestPath(lab):
+    """
+    Same result as shortestPath(lab), computed on cell ids i*m + j
+
+    Uses a deque for the BFS frontier, flat distance/parent arrays instead
+    of a dict of tuples, and the compiled adjacency of lab.
+    """
+    n, m = lab.n, lab.m
+    offsets, targets = lab.compileAdjacency().csr()
+    start = 0
+    target = n * m - 1
+    distances = array('i', [-1]) * (n * m)
+    parents = array('i', [-1]) * (n * m)
+    distances[start] = 0
+    candidates = deque([start])
+    isPerfect = True
+    while candidates:
+        p = candidates.popleft()
+        d = distances[p] + 1
+        for q in targets[offsets[p]:offsets[p+1]]:
+            if distances[q] < 0:
+                distances[q] = d
+                parents[q] = p
+                candidates.append(q)
+                if q == target:
+                    break
+            elif distances[q] != d - 2:
+                isPerfect = False
+    if distances[target] < 0:
+        raise ValueError("No path from {} to {}".format((0, 0), divmod(target, m)))
+    path = []
+    current = target
+    while current != start:
+        path.append(divmod(current, m))
+        current = parents[current]
+    path.reverse()
+
+    return path, isPerfect
+
+
+def neighborIdsFunction(lab):
+    """
+    Return a function giving the list of neighbors of a cell id i*m + j,
+    in the same order as Labyrinth2D.neighbors
+    """
+    return lab.compileAdjacency().neighborIds
+
+def pathFromParents(parents, source, target, m):
+    """Path from source (excluded) to target (included) following the parent array from target"""
+    path = []
+    current = target
+    while current != source:
+        path.append(divmod(current, m))
+        current = parents[current]
+    path.reverse()
+    return path
+
+def bfsPath(lab, source, target):
+    """Shortest path from source to target with a BFS stopping at target"""
+    m = lab.m
+    neighborIds = neighborIdsFunction(lab)
+    parents = array('i', [-1]) * (lab.n * m)
+    parents[source] = source
+    candidates = deque([source])
+    while candidates and parents[target] < 0:
+        p = candidates.popleft()
+        for q in neighborIds(p):
+            if parents[q] < 0:
+                parents[q] = p
+                candidates.append(q)
+    if parents[target] < 0:
+        return None
+    return pathFromParents(parents, source, target, m)
+
+def bidirectionalPath(lab, source, target):
+    """
+    Shortest path from source to target with two BFS, from source and from
+    target, expanding one whole layer of the smallest frontier at a time
+    """
+    m = lab.m
+    if source == target: return []
+    neighborIds = neighborIdsFunction(lab)
+    size = lab.n * m
+    parents = (array('i', [-1]) * size, array('i', [-1]) * size)
+    distances = (array('i', [-1]) * size, array('i', [-1]) * size)
+    frontiers = ([source], [target])
+    for side, cell in ((0, source), (1, target)):
+        parents[side][cell] = cell
+        distances[side][cell] = 0
+    while frontiers[0] and frontiers[1]:
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        myParents, myDistances = parents[side], distances[side]
+        otherDistances = distances[1 - side]
+        best = None
+        nextFrontier = []
+        for p in frontiers[side]:
+            d = myDistances[p] + 1
+            for q in neighborIds(p):
+                if myDistances[q] < 0:
+                    myParents[q] = p
+                    myDistances[q] = d
+                    nextFrontier.append(q)
+                    if otherDistances[q] >= 0 and (best is None or d + otherDistances[q] < best[0]):
+                        best = (d + otherDistances[q], q)
+        if best is not None:
+            meeting = best[1]
+            path = pathFromParents(parents[0], source, meeting, m)
+            current = meeting
+            while current != target:
+                current = parents[1][current]
+                path.append(divmod(current, m))
+            return path
+        frontiers = (nextFrontier, frontiers[1]) if side == 0 else (frontiers[0], nextFrontier)
+    return None
+
+def astarPath(lab, source, target):
+    """Shortest path from source to target with A*, using the Manhattan distance as heuristic"""
+    from solution_visit import manhattanDistance
+    m = lab.m
+    neighborIds = neighborIdsFunction(lab)
+    targetPosition = divmod(target, m)
+    size = lab.n * m
+    parents = array('i', [-1]) * size
+    distances = array('i', [-1]) * size
+    parents[source] = source
+    distances[source] = 0
+    # Ties are broken towards the deepest cells
+    heap = [ (manhattanDistance(divmod(source, m), targetPosition), 0, source) ]
+    while heap:
+        _, negDistance, p = heapq.heappop(heap)
+        if p == target:
+            return pathFromParents(parents, source, target, m)
+        if -negDistance > distances[p]: continue
+        d = distances[p] + 1
+        for q in neighborIds(p):
+            if distances[q] < 0 or d < distances[q]:
+                distances[q] = d
+                parents[q] = p
+                heapq.heappush(heap, (d + manhattanDistance(divmod(q, m), targetPosition), -d, q))
+    return None
+
+def findPath(lab, source = (0, 0), target = None, method = "bfs"):
+    """
+    Return a shortest path from source to target (default: (n-1, m-1)),
+    as the list of cells after source up to target
+
+    method is one of "bfs", "bidir" (bidirectional BFS) or "astar".
+    Raise ValueError if target cannot be reached.
+    """
+    if target is None: target = (lab.n - 1, lab.m - 1)
+    for p in (source, target):
+        if not (0 <= p[0] < lab.n and 0 <= p[1] < lab.m):
+            raise ValueError("Position {} is outside the labyrinth".format(p))
+    solvers = { "bfs": bfsPath, "bidir": bidirectionalPath, "astar": astarPath }
+    if method not in solvers:
+        raise ValueError("Unknown method {}, expected one of {}".format(method, ", ".join(METHODS)))
+    path = solvers[method](lab, source[0] * lab.m + source[1], target[0] * lab.m + target[1])
+    if path is None:
+        raise ValueError("No path from {} to {}".format(source, target))
+    return path
+
+
+class BFSTreeCache:
+    """
+    Shortest paths of a labyrinth from a BFS tree per source
+
+    Trees are kept with least-recently-used eviction, as long as their
+    total size stays within 'budget' bytes (at least one tree is kept).
+    """
+
+    def __init__(self, lab, budget = 256 * 2**20):
+        self.labyrinth = lab
+        self.neighborIds = neighborIdsFunction(lab)
+        size = lab.n * lab.m
+        treeSize = 2 * array('i').itemsize * size
+        self.maxTrees = max(1, budget // treeSize)
+        self.trees = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def tree(self, source):
+        """(parents, distances) arrays of the BFS from cell id source"""
+        tree = self.trees.get(source)
+        if tree is not None:
+            self.hits += 1
+            self.trees.move_to_end(source)
+            return tree
+        self.misses += 1
+        size = self.labyrinth.n * self.labyrinth.m
+        parents = array('i', [-1]) * size
+        distances = array('i', [-1]) * size
+        parents[source] = source
+        distances[source] = 0
+        candidates = deque([source])
+        neighborIds = self.neighborIds
+        while candidates:
+            p = candidates.popleft()
+            d = distances[p] + 1
+            for q in neighborIds(p):
+                if distances[q] < 0:
+                    distances[q] = d
+                    parents[q] = p
+                    candidates.append(q)
+        if len(self.trees) >= self.maxTrees:
+            self.trees.popitem(last = False)
+        self.trees[source] = (parents, distances)
+        return parents, distances
+
+    def path(self, source, target):
+        """Shortest path like findPath(lab, source, target)"""
+        n, m = self.labyrinth.n, self.labyrinth.m
+        for p in (source, target):
+            if not (0 <= p[0] < n and 0 <= p[1] < m):
+                raise ValueError("Position {} is outside the labyrinth".format(p))
+        a, b = source[0] * m + source[1], target[0] * m + target[1]
+        parents, distances = self.tree(a)
+        if distances[b] < 0:
+            raise ValueError("No path from {} to {}".format(source, target))
+        return pathFromParents(parents, a, b, m)
+
+def batchQueries(solver, queries, out, paths = False):
+    """
+    Answer a stream of queries "i j k l" (path from (i, j) to (k, l)) with
+    solver.path, writing "i j k l length" for each, followed by the cells
+    of the path as "i,j" if paths is True
+
+    Empty lines and lines starting with # are ignored. Invalid or
+    unreachable queries get length -1 and a message on standard error.
+    """
+    import sys
+    for line, query in enumerate(queries, 1):
+        query = query.strip()
+        if not query or query.startswith("#"): continue
+        result = -1
+        path = []
+        try:
+            values = [ int(x) for x in query.split() ]
+            if len(values) != 4:
+                raise ValueError("Queries should have length 4, not {}".format(len(values)))
+            path = solver.path((values[0], values[1]), (values[2], values[3]))
+            result = len(path)
+        except ValueError as e:
+            print("Line {}, error: {}".format(line, e), file = sys.stderr)
+        answer = "{} {}".format(query, result)
+        if paths and path:
+            answer += " " + " ".join("{},{}".format(i, j) for i, j in path)
+        out.write(answer + "\n")
+        out.flush()
+
+def loadOrBuildIndex(lab, filename):
+    """
+    Tree index of lab (see treeindex.TreeIndex), loaded from the index file
+    of 'filename' if it is up to date, else built and saved there
+
+    Nothing is saved if filename is "-" (standard input), and a failure to
+    save is ignored. Return None if lab is not perfect
+    """
+    import os
+    from treeindex import TreeIndex, indexFilename
+
+    indexFile = indexFilename(filename) if filename != "-" else None
+    if indexFile is not None and os.path.exists(indexFile):
+        try:
+            with open(indexFile, 'rb') as file:
+                return TreeIndex.load(file, lab)
+        except ValueError:
+            pass
+    try:
+        index = TreeIndex(lab)
+    except ValueError:
+        return None
+    if indexFile is not None:
+        try:
+            with open(indexFile, 'wb') as file:
+                index.save(file)
+        except OSError:
+            pass
+    return index
+
+def bfsDistances(lab, source):
+    """Array of the distances from cell id source to all cell ids, -1 for unreachable cells"""
+    offsets, targets = lab.compileAdjacency().csr()
+    distances = array('i', [-1]) * (lab.n * lab.m)
+    distances[source] = 0
+    candidates = deque([source])
+    while candidates:
+        p = candidates.popleft()
+        d = distances[p] + 1
+        for q in targets[offsets[p]:offsets[p+1]]:
+            if distances[q] < 0:
+                distances[q] = d
+                candidates.append(q)
+    return distances
+
+# Labyrinth and cell ids of the points of a worker process of distanceMatrix
+_workerLabyrinth = None
+_workerPoints = None
+
+def _initDistanceWorker(filename, points):
+    global _workerLabyrinth, _workerPoints
+    from labyrinth import loadLabyrinth
+    _workerLabyrinth = loadLabyrinth(filename)
+    _workerPoints = points
+
+def _distanceRow(source):
+    distances = bfsDistances(_workerLabyrinth, source)
+    return array('i', [ distances[c] for c in _workerPoints ])
+
+def distanceMatrix(lab, points, workers = 1, index = None, filename = None):
+    """
+    Distances between all pairs of positions in points, as a flat array
+    of k*k integers (row-major, k = len(points)), -1 if unreachable
+
+    With a TreeIndex of lab (see treeindex), distances come from the index.
+    Otherwise, one BFS is run per distinct point, in 'workers' processes
+    (None for one per CPU). Workers load the labyrinth from filename if it
+    is a binary file, from a temporary binary file otherwise.
+    """
+    import os
+    m = lab.m
+    for p in points:
+        if not (0 <= p[0] < lab.n and 0 <= p[1] < m):
+            raise ValueError("Position {} is outside the labyrinth".format(p))
+    k = len(points)
+    matrix = array('i', [0]) * (k * k)
+    if index is not None:
+        for a in range(k):
+            for b in range(a + 1, k):
+                matrix[a * k + b] = matrix[b * k + a] = index.distance(points[a], points[b])
+        return matrix
+    ids = [ i * m + j for i, j in points ]
+    sources = list(dict.fromkeys(ids))
+    if workers is None: workers = os.cpu_count() or 1
+    if workers == 1 or len(sources) == 1:
+        rows = [ array('i', [ distances[c] for c in ids ])
+                 for distances in map(lambda s: bfsDistances(lab, s), sources) ]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        from labyrinth import binaryLabyrinthFile
+        with binaryLabyrinthFile(filename, lab) as binary:
+            with ProcessPoolExecutor(max_workers = workers, initializer = _initDistanceWorker,
+                                     initargs = (binary, ids)) as executor:
+                rows = list(executor.map(_distanceRow, sources))
+    rowOf = dict(zip(sources, rows))
+    for a, c in enumerate(ids):
+        matrix[a * k:(a+1) * k] = rowOf[c]
+    return matrix
+
+def saveNpy(file, values, shape):
+    """
+    Save the array('i') values to file (opened in binary mode) in NumPy
+    .npy format, as a little-endian int32 array of the given shape
+    """
+    import sys
+    header = "{{'descr': '<i4', 'fortran_order': False, 'shape': {}, }}".format(tuple(shape))
+    # Magic, version 1.0, header length; the data starts on a multiple of 64 bytes
+    padding = -(10 + len(header) + 1) % 64
+    header = header + " " * padding + "\n"
+    file.write(b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1"))
+    if sys.byteorder != "little":
+        values = array('i', values)
+        values.byteswap()
+    values.tofile(file)
+
+def readPoints(lines):
+    """Positions "i j" of lines, ignoring empty lines and lines starting with #"""
+    points = []
+    for line, text in enumerate(lines, 1):
+        text = text.strip()
+        if not text or text.startswith("#"): continue
+        values = text.split()
+        if len(values) != 2:
+            raise ValueError("Line {}, error: Points should have length 2, not {}".format(line, len(values)))
+        points.append((int(values[0]), int(values[1])))
+    return points
+
+
+def main(argv = None):
+    """Command line interface; argv defaults to sys.argv[1:], return the exit status"""
     import argparse
+    import sys
+    from contextlib import nullcontext
+    from labyrinth import STORAGES, loadLabyrinth
+    from visit import HeadlessVisit, AnsiObserver
 
     parser = argparse.ArgumentParser("Visit a labyrinth with shortest path")
-    parser.add_argument("file", type = argparse.FileType('r'), help = "input file")
+    parser.add_argument("file", help = "input file, in CSV or binary format ('-' for standard input)")
     parser.add_argument("-q", dest = "display", action = "store_false",
                         help = "Turn off displaying")
     parser.add_argument("-d", dest = "delay", type = float, default = 0.05,
                         help = "Time delay between two displays")
     parser.add_argument("-i", dest = "interval", type = int, default = 1,
                         help = "Number of step between two displays")
+    parser.add_argument("--storage", choices = STORAGES, default = None,
+                        help = "Memory layout of the walls (bytes: 1 byte per wall, bits: 1 bit per wall; "
+                               "default: list for CSV, bits for binary files)")
+    parser.add_argument("--slow", action = "store_true",
+                        help = "Use the reference implementation of the shortest path")
+    parser.add_argument("--method", choices = METHODS, default = "bfs",
+                        help = "Search algorithm: BFS, bidirectional BFS or A* (default: bfs)")
+    parser.add_argument("--source", type = int, nargs = 2, metavar = ("I", "J"), default = (0, 0),
+                        help = "Starting cell (default: 0 0)")
+    parser.add_argument("--target", type = int, nargs = 2, metavar = ("I", "J"), default = None,
+                        help = "Exit cell (default: n-1 m-1)")
+    parser.add_argument("--index", action = "store_true",
+                        help = "Answer with the tree index of a perfect labyrinth, loaded from FILE.idx "
+                               "or built and saved there")
+    parser.add_argument("--batch", metavar = "QUERIES", nargs = "?", const = "-", default = None,
+                        help = "Answer the queries \"i j k l\" (one per line) of the file QUERIES "
+                               "(default: standard input), without displaying")
+    parser.add_argument("--paths", action = "store_true",
+                        help = "In batch mode, also write the cells of each path")
+    parser.add_argument("--cache", metavar = "MB", type = float, default = 256,
+                        help = "In batch mode, memory budget for caching BFS trees (default: 256)")
+    parser.add_argument("--matrix", metavar = "POINTS", default = None,
+                        help = "Compute the distances between all pairs of points \"i j\" (one per line) "
+                               "of the file POINTS ('-' for standard input), without displaying")
+    parser.add_argument("-o", dest = "output", default = None,
+                        help = "With --matrix, save the matrix to this file in NumPy .npy format "
+                               "(default: print it)")
+    parser.add_argument("-j", "--workers", type = int, default = 1,
+                        help = "With --matrix, number of processes running BFS (0 for one per CPU)")
     parser.add_argument("--draw", default=None, help="Draw the labyrinth and the path in a file")
+    parser.add_argument("--cell-size", type = int, default = 40,
+                        help = "Size of the cells in pixels when drawing (default: 40)")
+    parser.add_argument("--to-binary", metavar = "FILE", default = None,
+                        help = "Convert the labyrinth to binary format in FILE, without solving it")
+    parser.add_argument("--to-csv", metavar = "FILE", default = None,
+                        help = "Convert the labyrinth to CSV format in FILE, without solving it")
+    parser.add_argument("--profile", metavar = "FILE", default = None,
+                        help = "Save counters and phase timings of the run in JSON format in FILE "
+                               "('-' for standard error)")
+    parser.add_argument("--cprofile", metavar = "FILE", default = None,
+                        help = "With --profile, also run cProfile, save its statistics in FILE "
+                               "and list the top functions in the report")
     
-    args = parser.parse_args()
-    lab = Labyrinth2DFromFile(args.file)
-    path, isPerfect = shortestPath(lab)
-    if not isPerfect: print("Imperfect labyrinth !")
-    visit = Visit(lab, display = args.display, sleepTime = args.delay, displayFrequency = args.interval)
+    args = parser.parse_args(argv)
+    if args.file == "-" and "-" in (args.batch, args.matrix):
+        parser.error("the labyrinth and the queries or points cannot both be read from standard input")
+    if args.cprofile and not args.profile:
+        parser.error("--cprofile needs --profile")
+    if args.profile:
+        import profiling
+        profiling.start(args.profile, args.cprofile, phase = "solve")
+    lab = loadLabyrinth(args.file, storage = args.storage)
+    if args.to_binary or args.to_csv:
+        if args.to_binary:
+            with open(args.to_binary, 'wb') as out:
+                lab.saveBinary(out)
+        if args.to_csv:
+            with open(args.to_csv, 'w') as out:
+                lab.saveCSV(out)
+        return 0
+    source = tuple(args.source)
+    target = tuple(args.target) if args.target else (lab.n - 1, lab.m - 1)
+    index = None
+    if args.index:
+        index = loadOrBuildIndex(lab, args.file)
+        if index is None: print("Imperfect labyrinth, cannot use the index", file = sys.stderr)
+    if args.matrix:
+        with open(args.matrix) if args.matrix != "-" else nullcontext(sys.stdin) as lines:
+            points = readPoints(lines)
+        if index is None:
+            from treeindex import TreeIndex
+            try:
+                index = TreeIndex(lab)
+            except ValueError:
+                pass
+        matrix = distanceMatrix(lab, points, workers = args.workers or None, index = index, filename = args.file)
+        if args.output:
+            with open(args.output, 'wb') as out:
+                saveNpy(out, matrix, (len(points), len(points)))
+        else:
+            for a in range(len(points)):
+                print(" ".join(map(str, matrix[a * len(points):(a+1) * len(points)])))
+        return 0
+    if args.batch:
+        solver = index if index is not None else BFSTreeCache(lab, budget = int(args.cache * 2**20))
+        with open(args.batch) if args.batch != "-" else nullcontext(sys.stdin) as queries:
+            batchQueries(solver, queries, sys.stdout, paths = args.paths)
+        return 0
+    if index is not None:
+        path = index.path(source, target)
+    elif args.method == "bfs" and source == (0, 0) and target == (lab.n - 1, lab.m - 1):
+        path, isPerfect = shortestPath(lab) if args.slow else fastShortestPath(lab)
+        if not isPerfect: print("Imperfect labyrinth !")
+    else:
+        path = findPath(lab, source, target, method = args.method)
+    visit = HeadlessVisit(lab, AnsiObserver(args.display, args.delay, args.interval),
+                          start = source, target = target)
     for p in path:
         visit.moveTo(p)
     assert visit.isFinish()
     if args.draw:
-        lab.draw(args.draw, path=path)
+        lab.draw(args.draw, path=path, start=source, cell_size = args.cell_size)
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import random
+from functools import partial
 
 def noMemoryVisit(choiceFunction, visit):
     previous = None
@@ -10,12 +11,12 @@ def noMemoryVisit(choiceFunction, visit):
         visit.moveTo(nextPosition)
     return visit.visitLength
 
-def randomChoiceFunction(neighbors, previous):
+def randomChoiceFunction(neighbors, previous, rng = random):
     if not previous:
-        return random.choice(neighbors)
+        return rng.choice(neighbors)
     idx = neighbors.index(previous)
     if len(neighbors) == 1: return neighbors[0]
-    else: return random.choice(neighbors[:idx] + neighbors[idx+1:])
+    else: return rng.choice(neighbors[:idx] + neighbors[idx+1:])
 
 def leftHandVisitFunction(neighbors, previous):
     if not previous:
@@ -37,7 +38,7 @@ def indexOfFirstPredicate(list, pred):
 
 # Only works for non-cyclic (perfect) labyrinths,
 # And only if the starting point is (0, 0)
-def planarVisit(visit):
+def planarVisit(visit, rng = random):
 
     def isVisited(p):
         return visit.visited[p[0]][p[1]]
@@ -63,7 +64,7 @@ def planarVisit(visit):
                     indexOfNext = indexOfFirstPredicate(neighbors, lambda p: not finished[p])
                     nextPosition = neighbors[indexOfNext]
                 else:
-                    nextPosition = random.choice(possibleChoices)
+                    nextPosition = rng.choice(possibleChoices)
                             
 
         previous = visit.currentPosition
@@ -99,6 +100,82 @@ def planarVisit(visit):
                         j -= 1
     return visit.visitLength
 
+def fastPlanarVisit(visit, rng = random):
+    """
+    Same visit as planarVisit, with the same calls to rng, on a HeadlessVisit
+
+    Runs on cell ids with flat visited/finished arrays. Each border keeps
+    how far it has been marked, as cells marked by planarVisit are never
+    scanned again. Falls back to planarVisit if the observer of the visit
+    watches moves.
+    """
+    if visit.observer is not None and visit.observer.watchesMoves:
+        return planarVisit(visit, rng)
+    from labyrinth import NEIGHBOR_OFFSETS
+    assert visit.currentPosition == (0, 0)
+    n, m = visit.n, visit.m
+    deltas = [ tuple(di * m + dj for di, dj in offsets) for offsets in NEIGHBOR_OFFSETS ]
+    masks = visit.masks
+    visited = visit.visitedCells
+    finished = bytearray(n * m)
+    target = visit.target[0] * m + visit.target[1]
+    # Borders i = 0, i = n-1, j = 0 and j = m-1 are marked up to these indices
+    top = bottom = left = right = 0
+    current = 0
+    length = visit.visitLength
+    first = True
+    while current != target:
+        neighbors = [ current + d for d in deltas[masks[current]] ]
+        if first:
+            nextCell = neighbors[0]
+            first = False
+        elif len(neighbors) == 1:
+            nextCell = neighbors[0]
+            finished[current] = 1
+        else:
+            possibleChoices = [ q for q in neighbors if not visited[q] ]
+            if not possibleChoices:
+                finished[current] = 1
+                for nextCell in neighbors:
+                    if not finished[nextCell]: break
+                else:
+                    raise ValueError("No element satisfies pred")
+            else:
+                nextCell = rng.choice(possibleChoices)
+
+        current = nextCell
+        visited[current] = 1
+        length += 1
+        i, j = divmod(current, m)
+        if i == 0:
+            for c in range(top, j):
+                while not visited[c]:
+                    visited[c] = finished[c] = 1
+                    c += m
+            top = max(top, j)
+        elif i == n - 1:
+            for c in range((n-1) * m + bottom, current):
+                while not visited[c]:
+                    visited[c] = finished[c] = 1
+                    c -= m
+            bottom = max(bottom, j)
+        elif j == 0:
+            for c in range(left * m, current, m):
+                while not visited[c]:
+                    visited[c] = finished[c] = 1
+                    c += 1
+            left = max(left, i)
+        elif j == m - 1:
+            for c in range(right * m + m - 1, current, m):
+                while not visited[c]:
+                    visited[c] = finished[c] = 1
+                    c -= 1
+            right = max(right, i)
+    visit.currentPosition = divmod(current, m)
+    visit.visitLength = length
+    visit.isFinish()
+    return length
+
 
 # From https://en.wikipedia.org/wiki/Maze_solving_algorithm#cite_ref-10
 # Source: Fattah, Mohammad; et, al. (2015-09-28). "A Low-Overhead,
@@ -107,9 +184,10 @@ def planarVisit(visit):
 # NOCS '15 Proceedings of the 9th International Symposium on
 # Networks-on-Chip. doi:10.1145/2786572.2786591.
 
-def manhattanVisit(visit):
-    def manhattanDistance(a, b): 
-        return abs(a[0] - b[0]) + abs(a[1] - b[1])
+def manhattanDistance(a, b): 
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+def manhattanVisit(visit, rng = None):
     def distance(pos):
         return manhattanDistance(visit.target, pos)
     def direction(neighbor): # 0 for South, 1 for West, 2 for North, 3 for East
@@ -148,14 +226,271 @@ def manhattanVisit(visit):
 
     return visit.visitLength
 
+def rightHandVisit(visit, rng = None):
+    return noMemoryVisit(rightHandVisitFunction, visit)
+
+def leftHandVisit(visit, rng = None):
+    return noMemoryVisit(leftHandVisitFunction, visit)
+
+def randomVisit(visit, rng = random):
+    return noMemoryVisit(partial(randomChoiceFunction, rng = rng), visit)
+
+# Visit strategies by name; all take a visit and a random generator
+STRATEGIES = {
+    "random": randomVisit,
+    "right": rightHandVisit,
+    "left": leftHandVisit,
+    "planar": fastPlanarVisit,
+    "manh": manhattanVisit,
+}
+
+
+# Step in the neighbor list of the wall followers
+_HAND_STEPS = { "left": 1, "right": -1 }
+
+def rootedTree(lab):
+    """
+    Parent and subtree size arrays of the perfect labyrinth lab, seen as a
+    tree rooted at (0, 0), indexed by cell id i*m + j
+
+    Raise ValueError if lab is not perfect
+    """
+    from array import array
+    size = lab.n * lab.m
+    offsets, targets = lab.compileAdjacency().csr()
+    parent = array('i', [-1]) * size
+    parent[0] = 0
+    order = array('i', [0])
+    k = 0
+    while k < len(order):
+        p = order[k]
+        k += 1
+        for q in targets[offsets[p]:offsets[p+1]]:
+            if parent[q] < 0:
+                parent[q] = p
+                order.append(q)
+            elif q != parent[p]:
+                raise ValueError("Labyrinth is not perfect: cycle through {}".format(divmod(q, lab.m)))
+    if len(order) != size:
+        raise ValueError("Labyrinth is not perfect: only {} cells out of {} are reachable".format(len(order), size))
+    sizes = array('i', [1]) * size
+    for k in range(size - 1, 0, -1):
+        c = order[k]
+        sizes[parent[c]] += sizes[c]
+    return parent, sizes
+
+def wallFollowerLength(lab, hand = "left", target = None, tree = None):
+    """
+    visitLength of leftHandVisit or rightHandVisit (hand is "left" or
+    "right") from (0, 0) to target, without simulating the visit
+
+    On a perfect labyrinth, the follower walks along the tree path from
+    (0, 0) to target; at each cell of the path, it fully explores the
+    subtrees met before the next cell of the path, in the rotation order of
+    the neighbor lists, which costs two moves per cell of these subtrees.
+    tree is rootedTree(lab), computed if not given. Raise ValueError if lab
+    is not perfect.
+    """
+    step = _HAND_STEPS[hand]
+    if target is None: target = (lab.n - 1, lab.m - 1)
+    parent, sizes = tree if tree is not None else rootedTree(lab)
+    neighborIds = lab.compileAdjacency().neighborIds
+    path = [ target[0] * lab.m + target[1] ]
+    while path[-1] != 0:
+        path.append(parent[path[-1]])
+    path.reverse()
+    moves = len(path) - 1
+    for k in range(len(path) - 1):
+        neighbors = neighborIds(path[k])
+        # Like leftHandVisitFunction and rightHandVisitFunction
+        if k == 0: idx = 0 if step > 0 else len(neighbors) - 1
+        else: idx = (neighbors.index(path[k-1]) + step) % len(neighbors)
+        while neighbors[idx] != path[k+1]:
+            moves += 2 * sizes[neighbors[idx]]
+            idx = (idx + step) % len(neighbors)
+    return moves + 1
+
+def wallFollowerSequence(lab, hand = "left", target = None):
+    """
+    Iterate over the cells of leftHandVisit or rightHandVisit from (0, 0)
+    to target (both included), on the compiled adjacency of lab
+    """
+    step = _HAND_STEPS[hand]
+    m = lab.m
+    if target is None: target = (lab.n - 1, lab.m - 1)
+    target = target[0] * m + target[1]
+    neighborIds = lab.compileAdjacency().neighborIds
+    previous, current = None, 0
+    yield (0, 0)
+    while current != target:
+        neighbors = neighborIds(current)
+        if previous is None: idx = 0 if step > 0 else len(neighbors) - 1
+        else: idx = (neighbors.index(previous) + step) % len(neighbors)
+        previous, current = current, neighbors[idx]
+        yield divmod(current, m)
+
+def wallFollowerVisit(lab, hand = "left", sequence = False, tree = None):
+    """
+    visitLength of leftHandVisit or rightHandVisit on lab, and the list of
+    visited cells if sequence is True
+
+    The length is computed with wallFollowerLength on perfect labyrinths,
+    and by simulating the visit otherwise.
+    """
+    try:
+        length = wallFollowerLength(lab, hand, tree = tree)
+    except ValueError:
+        from visit import HeadlessVisit
+        length = STRATEGIES[hand](HeadlessVisit(lab))
+    if sequence:
+        return length, list(wallFollowerSequence(lab, hand))
+    return length
+
+
+# Labyrinth and direction masks of a worker process of runMonteCarlo
+_workerLabyrinth = None
+_workerMasks = None
+
+def _initWorker(filename):
+    global _workerLabyrinth, _workerMasks
+    from labyrinth import loadLabyrinth
+    _workerLabyrinth = loadLabyrinth(filename)
+    _workerMasks = _workerLabyrinth.directionMasks()
+
+def _runVisits(strategy, seed, runs):
+    """Visit lengths of the given runs, each with its own random generator"""
+    from visit import HeadlessVisit
+    lengths = []
+    for run in runs:
+        rng = random.Random("{}:{}".format(seed, run))
+        visit = HeadlessVisit(_workerLabyrinth, masks = _workerMasks)
+        lengths.append(STRATEGIES[strategy](visit, rng))
+    return lengths
+
+def runMonteCarlo(filename, strategy, repetitions, workers = None, seed = 0):
+    """
+    Return the visit lengths of 'repetitions' visits of the labyrinth in
+    'filename' with the given strategy (a key of STRATEGIES)
+
+    Runs are spread over 'workers' processes (default: one per CPU, 1 runs
+    in this process). Run k uses random.Random("seed:k"), so results do not
+    depend on the number of workers. Workers share the labyrinth by
+    memory-mapping it in binary format; a CSV file is converted to a
+    temporary binary file first.
+    """
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    from labyrinth import binaryLabyrinthFile
+
+    if workers is None: workers = os.cpu_count() or 1
+    with binaryLabyrinthFile(filename) as filename:
+        if workers == 1:
+            _initWorker(filename)
+            return _runVisits(strategy, seed, range(repetitions))
+        chunkSize = max(1, repetitions // (4 * workers))
+        chunks = [ range(k, min(k + chunkSize, repetitions)) for k in range(0, repetitions, chunkSize) ]
+        with ProcessPoolExecutor(max_workers = workers, initializer = _initWorker,
+                                 initargs = (filename,)) as executor:
+            results = executor.map(_runVisits, [strategy] * len(chunks), [seed] * len(chunks), chunks)
+            return [ length for lengths in results for length in lengths ]
+
+def neighborTable(numpy, masks, m):
+    """
+    Neighbor ids of all cells from their direction masks, as an (n*m) x 4
+    numpy array: row c lists the neighbors of cell id c in the order of
+    Labyrinth2D.neighbors(), padded with -1. Also return the degrees.
+    """
+    from labyrinth import DIRECTIONS
+    masks = numpy.frombuffer(bytes(masks), dtype = numpy.uint8)
+    cells = numpy.arange(len(masks), dtype = numpy.int32)
+    table = numpy.full((len(masks), 4), -1, dtype = numpy.int32)
+    for k, (bit, di, dj) in enumerate(DIRECTIONS):
+        table[:, k] = numpy.where(masks & bit, cells + (di * m + dj), -1)
+    # Move the actual neighbors first, keeping their order
+    order = numpy.argsort(table < 0, axis = 1, kind = "stable")
+    table = numpy.take_along_axis(table, order, axis = 1)
+    return table, (table >= 0).sum(axis = 1).astype(numpy.int32)
+
+def batchRandomVisits(lab, walkers, seed = None, start = (0, 0), target = None,
+                      maxSteps = None, masks = None):
+    """
+    Return the visit lengths of 'walkers' independent random visits of lab
+
+    The visits follow randomVisit (a random neighbor other than the
+    previous cell, unless at a dead end), but all walkers move at once on
+    numpy arrays. Lengths are counted like visitLength, and are -1 for the
+    walkers that did not reach the target within maxSteps moves. Without
+    numpy, the visits are run one by one with randomVisit.
+    """
+    from labyrinth import _importNumpy
+    n, m = lab.n, lab.m
+    if target is None: target = (n - 1, m - 1)
+    if masks is None: masks = lab.directionMasks()
+    numpy = _importNumpy()
+    if numpy is None:
+        from visit import HeadlessVisit
+        rng = random.Random(seed)
+        if maxSteps is not None:
+            raise ValueError("maxSteps needs numpy")
+        return [ randomVisit(HeadlessVisit(lab, start = start, target = target, masks = masks), rng)
+                 for _ in range(walkers) ]
+
+    table, degrees = neighborTable(numpy, masks, m)
+    if start != target and not degrees[start[0] * m + start[1]]:
+        raise ValueError("No move possible from {}".format(start))
+    rng = numpy.random.default_rng(seed)
+    targetId = target[0] * m + target[1]
+    lengths = numpy.full(walkers, -1, dtype = numpy.int64)
+    current = numpy.full(walkers, start[0] * m + start[1], dtype = numpy.int32)
+    previous = numpy.full(walkers, -1, dtype = numpy.int32)
+    walking = numpy.arange(walkers)
+    steps = 0
+    while len(walking) and (maxSteps is None or steps < maxSteps):
+        arrived = current == targetId
+        if arrived.any():
+            lengths[walking[arrived]] = steps + 1
+            keep = ~arrived
+            walking, current, previous = walking[keep], current[keep], previous[keep]
+            if not len(walking): break
+        neighbors = table[current]
+        degree = degrees[current]
+        # Choose among the neighbors except the previous cell, if any and
+        # if it is not the only neighbor
+        excluded = (previous >= 0) & (degree > 1)
+        choice = (rng.random(len(walking)) * (degree - excluded)).astype(numpy.int32)
+        previousIndex = numpy.argmax(neighbors == previous[:, None], axis = 1)
+        choice += excluded & (choice >= previousIndex)
+        previous = current
+        current = neighbors[numpy.arange(len(walking)), choice]
+        steps += 1
+    if len(walking) and (current == targetId).any():
+        lengths[walking[current == targetId]] = steps + 1
+    return lengths.tolist()
+
+def summarize(lengths):
+    """Mean, standard deviation, extrema and percentiles of visit lengths"""
+    import statistics
+    summary = { "runs": len(lengths), "mean": statistics.fmean(lengths),
+                "stddev": statistics.stdev(lengths) if len(lengths) > 1 else 0.0,
+                "min": min(lengths), "max": max(lengths) }
+    if len(lengths) > 1:
+        percentiles = statistics.quantiles(lengths, n = 100, method = "inclusive")
+        for p in (50, 90, 99):
+            summary["p{}".format(p)] = percentiles[p - 1]
+    else:
+        for p in (50, 90, 99):
+            summary["p{}".format(p)] = lengths[0]
+    return summary
+
         
-if __name__ == "__main__":
+def main(argv = None):
+    """Command line interface; argv defaults to sys.argv[1:], return the exit status"""
     import argparse
-    from labyrinth import *
-    from visit import *
+    from labyrinth import STORAGES, loadLabyrinth
+    from visit import HeadlessVisit, AnsiObserver
 
     parser = argparse.ArgumentParser("Visit a labyrinth with several algorithms")
-    parser.add_argument("file", type = argparse.FileType('r'), help = "input file")
+    parser.add_argument("file", help = "input file, in CSV or binary format ('-' for standard input)")
     parser.add_argument("type", choices = ("random", "right", "left", "planar", "manh"), help = "visit type")
     parser.add_argument("-q", dest = "display", action = "store_false",
                         help = "Turn off displaying")
@@ -163,19 +498,69 @@ if __name__ == "__main__":
                         help = "Time delay between two displays")
     parser.add_argument("-i", dest = "interval", type = int, default = 1,
                         help = "Number of step between two displays")
+    parser.add_argument("--storage", choices = STORAGES, default = None,
+                        help = "Memory layout of the walls (bytes: 1 byte per wall, bits: 1 bit per wall; "
+                               "default: list for CSV, bits for binary files)")
     parser.add_argument("-n", dest = "repet", type = int, default = 1,
                         help = "Number of repetitions of the algorithm")
+    parser.add_argument("-j", "--workers", type = int, default = None,
+                        help = "Run the repetitions without display in this many processes "
+                               "(0 for one per CPU), and report statistics")
+    parser.add_argument("--seed", type = int, default = None,
+                        help = "Seed of the random generators of the repetitions (implies -j 1 if -j is not given)")
+    parser.add_argument("--vectorized", action = "store_true",
+                        help = "Run the random visits all at once with numpy, without display, and report statistics")
+    parser.add_argument("--analytic", action = "store_true",
+                        help = "Compute the length of left or right visits without simulating them "
+                               "(simulated without display on imperfect labyrinths)")
+    parser.add_argument("--profile", metavar = "FILE", default = None,
+                        help = "Save counters and phase timings of the run in JSON format in FILE "
+                               "('-' for standard error)")
+    parser.add_argument("--cprofile", metavar = "FILE", default = None,
+                        help = "With --profile, also run cProfile, save its statistics in FILE "
+                               "and list the top functions in the report")
     
-    args = parser.parse_args()
-    lab = Labyrinth2DFromFile(args.file)
+    args = parser.parse_args(argv)
+    if args.cprofile and not args.profile:
+        parser.error("--cprofile needs --profile")
+    if args.profile:
+        import profiling
+        profiling.start(args.profile, args.cprofile, phase = "solve")
+    if args.analytic:
+        if args.type not in ("left", "right"):
+            parser.error("--analytic only applies to left and right visits")
+        lab = loadLabyrinth(args.file, storage = args.storage)
+        length = wallFollowerVisit(lab, args.type)
+        print("Total visit length:", length)
+        print("Average: {}".format(float(length)))
+        return 0
+    if args.vectorized:
+        if args.type != "random":
+            parser.error("--vectorized only applies to random visits")
+        lab = loadLabyrinth(args.file, storage = args.storage)
+        summary = summarize(batchRandomVisits(lab, args.repet, seed = args.seed))
+        print("Average: {}".format(summary["mean"]))
+        print("Stddev: {stddev:.2f}, min: {min}, max: {max}, median: {p50}, p90: {p90}, p99: {p99}".format(**summary))
+        return 0
+    if args.workers is not None or args.seed is not None:
+        if args.file == "-":
+            parser.error("-j and --seed need a file name")
+        workers = 1 if args.workers is None else (args.workers or None)
+        lengths = runMonteCarlo(args.file, args.type, args.repet, workers = workers,
+                                seed = args.seed if args.seed is not None else 0)
+        summary = summarize(lengths)
+        print("Average: {}".format(summary["mean"]))
+        print("Stddev: {stddev:.2f}, min: {min}, max: {max}, median: {p50}, p90: {p90}, p99: {p99}".format(**summary))
+        return 0
+    lab = loadLabyrinth(args.file, storage = args.storage)
     if args.type == "planar":
         sum = 0
         for _ in range(args.repet):
-            visit = Visit(lab, args.display, sleepTime = args.delay, displayFrequency = args.interval)
-            sum += planarVisit(visit)
+            visit = HeadlessVisit(lab, AnsiObserver(args.display, args.delay, args.interval))
+            sum += fastPlanarVisit(visit)
         print("Average: {}".format(sum / args.repet))
     elif args.type == "manh":
-        visit = Visit(lab, args.display, sleepTime = args.delay, displayFrequency = args.interval)
+        visit = HeadlessVisit(lab, AnsiObserver(args.display, args.delay, args.interval))
         manhattanVisit(visit)
     else: 
         if args.type == "random":
@@ -187,15 +572,12 @@ if __name__ == "__main__":
 
         sum = 0
         for _ in range(args.repet):
-            visit = Visit(lab, args.display, sleepTime = args.delay, displayFrequency = args.interval)
+            visit = HeadlessVisit(lab, AnsiObserver(args.display, args.delay, args.interval))
             sum += noMemoryVisit(fun, visit)
         print("Average: {}".format(sum / args.repet))
+    return 0
 
-def rightHandVisit(visit):
-    return noMemoryVisit(rightHandVisitFunction, visit)
 
-def leftHandVisit(visit):
-    return noMemoryVisit(leftHandVisitFunction, visit)
-
-def randomVisit(visit):
-    return noMemoryVisit(randomChoiceFunction, visit)
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
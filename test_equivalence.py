@@ -0,0 +1,135 @@
+"""
+Checks that the optimized code paths give the same results as the
+reference implementations they replace
+
+Run with: python -m pytest -q test_equivalence.py
+"""
+import io
+import random
+
+import pytest
+
+import labyrinth
+from dynamicpath import DynamicDistances
+from solution_generate import GENERATORS, GenerateLabyrinth2D
+from solution_shortest import bfsDistances
+from solution_visit import STRATEGIES, fastPlanarVisit, planarVisit, rootedTree, wallFollowerLength
+from visit import HeadlessVisit
+
+def randomLabyrinth(rng, maxSize = 12, extraWalls = 0.3):
+    """Random labyrinth with up to maxSize cells per side, perfect or with a few walls removed"""
+    n, m = rng.randint(1, maxSize), rng.randint(1, maxSize)
+    random.seed(rng.random())
+    lab = GenerateLabyrinth2D(n, m)
+    if n > 1 and m > 1 and rng.random() < extraWalls:
+        lab.removeRandomWalls(rng.randint(1, (n - 1) * (m - 1) // 2 + 1))
+    return lab
+
+def randomWall(rng, lab):
+    """(i, j, isVertical) of a random inner wall position of lab"""
+    vertical = lab.m == 1 or lab.n > 1 and rng.random() < 0.5
+    if vertical:
+        return rng.randrange(lab.n - 1), rng.randrange(lab.m), True
+    return rng.randrange(lab.n), rng.randrange(lab.m - 1), False
+
+
+def test_dynamic_distances_match_bfs():
+    rng = random.Random(18)
+    for _ in range(60):
+        lab = randomLabyrinth(rng)
+        if lab.n * lab.m == 1: continue
+        source = (rng.randrange(lab.n), rng.randrange(lab.m))
+        dynamic = DynamicDistances(lab, source)
+        sourceId = source[0] * lab.m + source[1]
+        for _ in range(100):
+            i, j, isVertical = randomWall(rng, lab)
+            if rng.random() < 0.5:
+                dynamic.removeWall(i, j, isVertical)
+            else:
+                dynamic.addWall(i, j, isVertical)
+            expected = bfsDistances(lab, sourceId)
+            assert dynamic.distances == expected
+            reachable = sum(1 for d in expected if d >= 0)
+            assert dynamic.reachable == reachable
+            degrees = sum(len(lab.neighbors(divmod(c, lab.m))) for c, d in enumerate(expected) if d >= 0)
+            assert dynamic.edges == degrees // 2
+
+
+def test_wall_follower_length_matches_visit():
+    rng = random.Random(15)
+    for algo in GENERATORS:
+        for _ in range(15):
+            n, m = rng.randint(1, 15), rng.randint(1, 15)
+            random.seed(rng.random())
+            lab = GenerateLabyrinth2D(n, m, algo = algo)
+            tree = rootedTree(lab)
+            target = (rng.randrange(n), rng.randrange(m))
+            for hand in ("left", "right"):
+                assert wallFollowerLength(lab, hand) == STRATEGIES[hand](HeadlessVisit(lab))
+                expected = STRATEGIES[hand](HeadlessVisit(lab, target = target))
+                assert wallFollowerLength(lab, hand, target, tree) == expected
+
+
+def test_fast_planar_visit_matches_planar_visit():
+    rng = random.Random(16)
+    for algo in GENERATORS:
+        for _ in range(15):
+            n, m = rng.randint(1, 15), rng.randint(1, 15)
+            random.seed(rng.random())
+            lab = GenerateLabyrinth2D(n, m, algo = algo)
+            seed = rng.random()
+            slow, fast = HeadlessVisit(lab), HeadlessVisit(lab)
+            slowRng, fastRng = random.Random(seed), random.Random(seed)
+            assert fastPlanarVisit(fast, fastRng) == planarVisit(slow, slowRng)
+            assert fast.currentPosition == slow.currentPosition
+            assert fast.visitedCells == slow.visitedCells
+            # Same calls to the generator
+            assert fastRng.getstate() == slowRng.getstate()
+
+
+class LineByLineLabyrinth2D(labyrinth.Labyrinth2DFromFile):
+    """Reference reader, parsing every line with csv.reader"""
+
+    def readChunk(self, chunk, numpy = None):
+        return False
+
+def readCSV(cls, text, storage):
+    """Walls as lists of booleans read by cls from text, or the error message"""
+    try:
+        lab = cls(io.StringIO(text), storage = storage)
+    except ValueError as e:
+        return str(e)
+    return [ [ [ bool(walls[i][j]) for j in range(cols) ] for i in range(rows) ]
+             for walls, rows, cols in ((lab.verticalWalls, lab.n-1, lab.m), (lab.horizontalWalls, lab.n, lab.m-1)) ]
+
+# Replacements of a line of a valid file
+BAD_LINES = [ "", " ", "1 2", "1 2 V 3", "1 2 X", "1 2 v", "a 2 V", "1 b H", "-1 0 V", "0 -1 H",
+              "99 0 V", "0 99 H", "01 2 V", "1 02 H", "+1 2 V", " 1 2 V", "1  2 V", "1 2 V ",
+              "1,2,V", "1\t2\tV", "1 2 \"V\"", "1 2 V\r", "1 2 H\r", "123456789012345678901 0 V",
+              "1 2 \u00e9", "1 2 V2", "12V" ]
+
+@pytest.mark.parametrize("bulk", ["python", "numpy"])
+def test_bulk_csv_reader_matches_csv_reader(bulk, monkeypatch):
+    if bulk == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(labyrinth, "_importNumpy", lambda: None)
+    rng = random.Random(6)
+    for _ in range(40):
+        lab = randomLabyrinth(rng, maxSize = 8)
+        out = io.StringIO()
+        lab.saveCSV(out)
+        header, *lines = out.getvalue().splitlines()
+        cases = [ lines ]
+        if lines:
+            for bad in rng.sample(BAD_LINES, 8):
+                k = rng.randrange(len(lines))
+                cases.append(lines[:k] + [bad] + lines[k+1:])
+        for case in cases:
+            for end in ("\n", ""):
+                text = "\n".join([header] + case) + end
+                # Small chunks, so that errors can come after some bulk chunks
+                monkeypatch.setattr(labyrinth, "CSV_CHUNK_SIZE", rng.choice((16, 64, 1 << 20)))
+                for storage in ("list", "bits"):
+                    expected = readCSV(LineByLineLabyrinth2D, text, storage)
+                    assert readCSV(labyrinth.Labyrinth2DFromFile, text, storage) == expected, text
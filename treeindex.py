@@ -0,0 +1,169 @@
+import struct
+import sys
+import zlib
+from array import array
+from collections import deque
+
+from labyrinth import packWalls
+from solution_shortest import neighborIdsFunction
+
+# Index file: header (magic, version, reserved, n, m, checksum of the walls),
+# then the parent, depth and jump arrays as little-endian 32-bit integers
+INDEX_MAGIC = b"LIDX"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<4sHHIII")
+
+def indexFilename(filename):
+    """Name of the index file stored next to the labyrinth file 'filename'"""
+    return filename + ".idx"
+
+def wallsChecksum(lab):
+    """CRC32 of the walls of lab, to detect an index built for another labyrinth"""
+    checksum = zlib.crc32(packWalls(lab.verticalWalls, lab.n-1, lab.m))
+    return zlib.crc32(packWalls(lab.horizontalWalls, lab.n, lab.m-1), checksum)
+
+
+class TreeIndex:
+    """
+    Index of a perfect labyrinth seen as a tree rooted at (0, 0)
+
+    Distances between any two cells are computed in O(log(n m)) time, and
+    paths in O(log(n m) + path length), from the lowest common ancestor.
+
+    Attributes:
+      n, m:   labyrinth dimensions
+      parent: parent[c] is the parent of cell id c = i*m + j (the root is its own parent)
+      depth:  depth[c] is the distance from the root to c
+      jump:   jump pointers (Myers, 1983): an ancestor of c such that walking up
+              with jump or parent reaches any ancestor in O(log depth) steps
+    """
+
+    def __init__(self, lab):
+        """
+        Build the index of lab with a BFS from (0, 0)
+
+        Raise ValueError if lab is not perfect
+        """
+        self.n = lab.n
+        self.m = lab.m
+        self.checksum = wallsChecksum(lab)
+        size = self.n * self.m
+        parent = array('i', [-1]) * size
+        depth = array('i', [0]) * size
+        jump = array('i', [0]) * size
+        neighborIds = neighborIdsFunction(lab)
+        parent[0] = 0
+        candidates = deque([0])
+        nbCells = 1
+        while candidates:
+            p = candidates.popleft()
+            for q in neighborIds(p):
+                if parent[q] < 0:
+                    parent[q] = p
+                    depth[q] = depth[p] + 1
+                    # Same jump distance as p twice in a row: jump further
+                    jp = jump[p]
+                    if depth[p] - depth[jp] == depth[jp] - depth[jump[jp]]:
+                        jump[q] = jump[jp]
+                    else:
+                        jump[q] = p
+                    candidates.append(q)
+                    nbCells += 1
+                elif q != parent[p]:
+                    raise ValueError("Labyrinth is not perfect: cycle through {}".format(divmod(q, self.m)))
+        if nbCells != size:
+            raise ValueError("Labyrinth is not perfect: only {} cells out of {} are reachable".format(nbCells, size))
+        self.parent = parent
+        self.depth = depth
+        self.jump = jump
+
+    def save(self, file):
+        """Save the index to file, opened in binary mode"""
+        file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, self.n, self.m, self.checksum))
+        for values in (self.parent, self.depth, self.jump):
+            if sys.byteorder != "little":
+                values = array('i', values)
+                values.byteswap()
+            values.tofile(file)
+
+    @classmethod
+    def load(cls, file, lab = None):
+        """
+        Load an index saved with save() from file, opened in binary mode
+
+        Raise ValueError if the file is not a valid index, or if lab is given
+        and the index was built for another labyrinth
+        """
+        header = file.read(INDEX_HEADER.size)
+        if len(header) != INDEX_HEADER.size:
+            raise ValueError("File too short for a header")
+        magic, version, _, n, m, checksum = INDEX_HEADER.unpack(header)
+        if magic != INDEX_MAGIC:
+            raise ValueError("Not a labyrinth index file")
+        if version != INDEX_VERSION:
+            raise ValueError("Unsupported index format version {}".format(version))
+        if lab is not None and (lab.n != n or lab.m != m or wallsChecksum(lab) != checksum):
+            raise ValueError("Index was built for another labyrinth")
+        index = cls.__new__(cls)
+        index.n, index.m, index.checksum = n, m, checksum
+        arrays = []
+        for _ in range(3):
+            values = array('i')
+            try:
+                values.fromfile(file, n * m)
+            except EOFError:
+                raise ValueError("File too short for a {} x {} labyrinth".format(n, m))
+            if sys.byteorder != "little":
+                values.byteswap()
+            arrays.append(values)
+        index.parent, index.depth, index.jump = arrays
+        return index
+
+    def cellId(self, pos):
+        i, j = pos
+        if not (0 <= i < self.n and 0 <= j < self.m):
+            raise ValueError("Position {} is outside the labyrinth".format(pos))
+        return i * self.m + j
+
+    def ancestorAtDepth(self, c, d):
+        """Ancestor of cell id c at depth d (at most depth[c])"""
+        parent, depth, jump = self.parent, self.depth, self.jump
+        while depth[c] > d:
+            if depth[jump[c]] >= d: c = jump[c]
+            else: c = parent[c]
+        return c
+
+    def commonAncestor(self, a, b):
+        """Lowest common ancestor of cell ids a and b"""
+        parent, depth, jump = self.parent, self.depth, self.jump
+        if depth[a] > depth[b]: a = self.ancestorAtDepth(a, depth[b])
+        else: b = self.ancestorAtDepth(b, depth[a])
+        # a and b have the same depth, so do jump[a] and jump[b]
+        while a != b:
+            if jump[a] != jump[b]:
+                a, b = jump[a], jump[b]
+            else:
+                a, b = parent[a], parent[b]
+        return a
+
+    def distance(self, source, target):
+        """Length of the path between positions source and target"""
+        a, b = self.cellId(source), self.cellId(target)
+        depth = self.depth
+        return depth[a] + depth[b] - 2 * depth[self.commonAncestor(a, b)]
+
+    def path(self, source, target):
+        """Path from source (excluded) to target (included), like solution_shortest.findPath"""
+        a, b = self.cellId(source), self.cellId(target)
+        ancestor = self.commonAncestor(a, b)
+        parent, m = self.parent, self.m
+        up = []
+        while a != ancestor:
+            a = parent[a]
+            up.append(divmod(a, m))
+        down = []
+        while b != ancestor:
+            down.append(divmod(b, m))
+            b = parent[b]
+        down.reverse()
+        return up + down
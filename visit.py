@@ -1,8 +1,11 @@
 # from labyrinth import *
 import io
 import os
+import sys
 import time
 
+from labyrinth import DIRECTIONS, NEIGHBOR_OFFSETS
+
 #class by Lionel Eyraud Dubois <lionel.eyraud-dubois@u-bordeaux.fr>
 class Visit:
     """
@@ -16,7 +19,8 @@ class Visit:
     """
 
     
-    def __init__(self, laby, display = False, sleepTime = 0.05, displayFrequency = 1):
+    def __init__(self, laby, display = False, sleepTime = 0.05, displayFrequency = 1,
+                 start = (0, 0), target = None):
         """
         Start a new visit
         
@@ -25,15 +29,17 @@ class Visit:
           display:          show the visit in the terminal
           sleepTime:        time to wait between two displays
           displayFrequency: number of steps between two displays
+          start:            starting cell
+          target:           exit cell, (n-1, m-1) by default
 
         """
         self.labyrinth = laby
         self.n = self.labyrinth.n
         self.m = self.labyrinth.m
-        self.currentPosition = (0, 0)
+        self.currentPosition = start
         self.visited = [ [False] * self.m for i in range(self.n) ]
         self.visitCurrent()
-        self.target = (self.n - 1, self.m - 1)
+        self.target = target if target is not None else (self.n - 1, self.m - 1)
         self.visitLength = 1
 
         self.display = display
@@ -110,29 +116,295 @@ class Visit:
         
         Differentiate between current cell, visited cells, and other empty cells.
         """
-        wallChar = '█'
-        noWallChar = ' '
-        emptyCellChar = ' '
-        visitedCellChar = '‧'
-        currentCellChar = '◇'
-        def printLine(j):
-            buf = io.StringIO()
-            buf.write(wallChar)
-            for i in range(self.n):
-                if (i, j) == self.currentPosition: buf.write(currentCellChar)
-                elif self.visited[i][j]: buf.write(visitedCellChar)
-                else: buf.write(emptyCellChar)
-                if i < self.n-1:
-                    if self.labyrinth.verticalWalls[i][j]: buf.write(wallChar)
-                    else: buf.write(noWallChar)
-            buf.write(wallChar)
-            print(buf.getvalue())
-            buf.close()
-
-        print(wallChar * (2*self.n + 1))
-        for j in range(self.m-1):
-            printLine(j)
-            print(wallChar + wallChar.join(wallChar if self.labyrinth.horizontalWalls[i][j] else noWallChar
-                                           for i in range(self.n)) + wallChar)
-        printLine(self.m - 1)
-        print(wallChar * (2*self.n + 1))
+        printWideVisited(self)
+
+
+def printWideVisited(visit):
+    """Print the current state of a visit (Visit or HeadlessVisit)"""
+    wallChar = '█'
+    noWallChar = ' '
+    emptyCellChar = ' '
+    visitedCellChar = '‧'
+    currentCellChar = '◇'
+    labyrinth = visit.labyrinth
+    def printLine(j):
+        buf = io.StringIO()
+        buf.write(wallChar)
+        for i in range(visit.n):
+            if (i, j) == visit.currentPosition: buf.write(currentCellChar)
+            elif visit.visited[i][j]: buf.write(visitedCellChar)
+            else: buf.write(emptyCellChar)
+            if i < visit.n-1:
+                if labyrinth.verticalWalls[i][j]: buf.write(wallChar)
+                else: buf.write(noWallChar)
+        buf.write(wallChar)
+        print(buf.getvalue())
+        buf.close()
+
+    print(wallChar * (2*visit.n + 1))
+    for j in range(visit.m-1):
+        printLine(j)
+        print(wallChar + wallChar.join(wallChar if labyrinth.horizontalWalls[i][j] else noWallChar
+                                       for i in range(visit.n)) + wallChar)
+    printLine(visit.m - 1)
+    print(wallChar * (2*visit.n + 1))
+
+
+# Moves (di, dj) to their direction bit
+_MOVE_DIRECTIONS = { (di, dj): bit for bit, di, dj in DIRECTIONS }
+
+class HeadlessVisit:
+    """
+    Visit with the same interface as Visit, without any I/O on the hot path
+
+    Moves are checked with the direction masks of the labyrinth (see
+    Labyrinth2D.compileAdjacency). Visited cells are stored in the flat
+    bytearray visitedCells, indexed by cell id i*m + j; visited[i][j] still
+    works, through memoryview rows. Display and reporting are left to an
+    optional observer (see VisitObserver).
+
+    Attributes: 
+      currentPosition: tuple (i, j) describing the cell currently being visited
+      target:          tuple describing the exit's coordinates
+      visitLength:     number of steps so far
+      visited:         n x m array, non-zero for all visited cells
+    """
+
+    def __init__(self, laby, observer = None, start = (0, 0), target = None, masks = None):
+        """
+        Start a new visit of the Labyrinth2D object laby
+
+        observer is notified of the start, the moves and the end of the visit.
+        masks defaults to the masks of laby.compileAdjacency().
+        """
+        self.labyrinth = laby
+        self.n = laby.n
+        self.m = laby.m
+        self.masks = masks if masks is not None else laby.compileAdjacency().masks
+        self.visitedCells = bytearray(self.n * self.m)
+        view = memoryview(self.visitedCells)
+        self.visited = [ view[i * self.m:(i+1) * self.m] for i in range(self.n) ]
+        self.currentPosition = start
+        self.visitCurrent()
+        self.target = target if target is not None else (self.n - 1, self.m - 1)
+        self.visitLength = 1
+        self.observer = observer
+        if observer is not None:
+            observer.started(self)
+
+    def visitCurrent(self):
+        i, j = self.currentPosition
+        self.visitedCells[i * self.m + j] = 1
+
+    def currentNeighbors(self):
+        i, j = self.currentPosition
+        return [ (i + di, j + dj) for di, dj in NEIGHBOR_OFFSETS[self.masks[i * self.m + j]] ]
+
+    def isFinish(self):
+        """Return True if the visit is at the target"""
+        finish = self.currentPosition == self.target
+        if finish and self.observer is not None:
+            self.observer.finished(self)
+        return finish
+
+    def moveTo(self, nextPosition):
+        """
+        Move to a new position
+
+        nextPosition should belong to the list returned by currentNeighbors()
+        """
+        i, j = self.currentPosition
+        u, v = nextPosition
+        bit = _MOVE_DIRECTIONS.get((u - i, v - j))
+        if bit is None or not self.masks[i * self.m + j] & bit:
+            inside = 0 <= u < self.n and 0 <= v < self.m
+            errorMessage = "Wall exists" if bit is not None and inside else "Invalid move"
+            raise ValueError("From {} to {}: {}".format(self.currentPosition, nextPosition, errorMessage))
+        self.currentPosition = nextPosition
+        self.visitedCells[u * self.m + v] = 1
+        self.visitLength += 1
+        if self.observer is not None:
+            self.observer.moved(self)
+
+
+class VisitObserver:
+    """
+    Receive the events of a HeadlessVisit; all methods do nothing by default
+
+    watchesMoves is False if moved() does nothing, so that visit engines
+    may move without notifying the observer.
+    """
+
+    watchesMoves = True
+
+    def started(self, visit):
+        pass
+
+    def moved(self, visit):
+        pass
+
+    def finished(self, visit):
+        pass
+
+
+class TerminalObserver(VisitObserver):
+    """
+    Display a visit in the terminal, as Visit does
+
+    Parameters: 
+      display:          show the visit, otherwise only print its total length
+      sleepTime:        time to wait between two displays
+      displayFrequency: number of steps between two displays
+    """
+
+    def __init__(self, display = True, sleepTime = 0.05, displayFrequency = 1):
+        self.display = display
+        self.watchesMoves = display
+        self.sleepTime = sleepTime
+        self.displayFrequency = displayFrequency
+        self.step = 0
+
+    def started(self, visit):
+        if self.display:
+            os.system('clear')
+            printWideVisited(visit)
+
+    def moved(self, visit):
+        if self.display:
+            self.step += 1
+            if self.step == self.displayFrequency:
+                self.step = 0
+                time.sleep(self.sleepTime)
+                os.system('clear')
+                printWideVisited(visit)
+
+    def finished(self, visit):
+        if self.display:
+            os.system('clear')
+            printWideVisited(visit)
+        print("Total visit length:", visit.visitLength)
+
+
+class AnsiObserver(TerminalObserver):
+    """
+    Display a visit in the terminal with ANSI escape sequences
+
+    Walls are drawn once; each frame then only rewrites the cells that
+    changed since the previous one, in a single write to the standard
+    output. Mazes larger than the viewport (default: the terminal size)
+    are cropped around the current position, and scrolled when it gets
+    close to the border of the viewport. Only for HeadlessVisit.
+
+    Parameters: as TerminalObserver, and
+      viewport: (columns, rows) of cells to display
+    """
+
+    wallChar = '█'
+    noWallChar = ' '
+    emptyCellChar = ' '
+    visitedCellChar = '‧'
+    currentCellChar = '◇'
+
+    def __init__(self, display = True, sleepTime = 0.05, displayFrequency = 1, viewport = None):
+        super().__init__(display, sleepTime, displayFrequency)
+        if viewport is None:
+            import shutil
+            size = shutil.get_terminal_size()
+            viewport = ((size.columns - 1) // 2, (size.lines - 2) // 2)
+        self.viewport = (max(1, viewport[0]), max(1, viewport[1]))
+
+    def started(self, visit):
+        if self.display:
+            self.width = min(visit.n, self.viewport[0])
+            self.height = min(visit.m, self.viewport[1])
+            self.origin = None
+            self.frame(visit, "\x1b[?25l")
+
+    def moved(self, visit):
+        if self.display:
+            self.step += 1
+            if self.step == self.displayFrequency:
+                self.step = 0
+                time.sleep(self.sleepTime)
+                self.frame(visit)
+
+    def finished(self, visit):
+        if self.display:
+            self.frame(visit)
+            sys.stdout.write("\x1b[{};1H\x1b[?25h".format(2 * self.height + 2))
+            sys.stdout.flush()
+        print("Total visit length:", visit.visitLength)
+
+    def frame(self, visit, prefix = ""):
+        """Write the changes since the last frame"""
+        out = [prefix]
+        i, j = visit.currentPosition
+        i0, j0 = self.origin or (None, None)
+        # Scroll when the current cell gets within a quarter of the viewport of its border
+        if (self.origin is None
+            or not i0 + self.width // 4 <= i < i0 + self.width - self.width // 4 and (i0 > 0 or i0 + self.width < visit.n)
+            or not j0 + self.height // 4 <= j < j0 + self.height - self.height // 4 and (j0 > 0 or j0 + self.height < visit.m)):
+            origin = (min(max(i - self.width // 2, 0), visit.n - self.width),
+                      min(max(j - self.height // 2, 0), visit.m - self.height))
+            if origin != self.origin:
+                self.origin = origin
+                self.redraw(visit, out)
+                sys.stdout.write("".join(out))
+                sys.stdout.flush()
+                return
+        i0, j0 = self.origin
+        m, visited, shown = visit.m, visit.visitedCells, self.shown
+        for k in range(self.width):
+            start = (i0 + k) * m + j0
+            row = visited[start:start + self.height]
+            if row != shown[k]:
+                old = shown[k]
+                for l in range(self.height):
+                    if row[l] != old[l] and (i0 + k, j0 + l) != (i, j):
+                        out.append(self.cell(k, l, self.visitedCellChar))
+                shown[k] = row
+        if self.current != (i, j):
+            ci, cj = self.current
+            if i0 <= ci < i0 + self.width and j0 <= cj < j0 + self.height:
+                out.append(self.cell(ci - i0, cj - j0, self.visitedCellChar))
+            out.append(self.cell(i - i0, j - j0, self.currentCellChar))
+            self.current = (i, j)
+        sys.stdout.write("".join(out))
+        sys.stdout.flush()
+
+    def cell(self, k, l, char):
+        """Escape sequence writing char at the cell (k, l) of the viewport"""
+        return "\x1b[{};{}H{}".format(2 * l + 2, 2 * k + 2, char)
+
+    def redraw(self, visit, out):
+        """Append the whole viewport to out, and remember the displayed cells"""
+        labyrinth = visit.labyrinth
+        n, m = visit.n, visit.m
+        i0, j0 = self.origin
+        wall, noWall = self.wallChar, self.noWallChar
+        out.append("\x1b[2J")
+        self.shown = []
+        for k in range(self.width):
+            start = (i0 + k) * m + j0
+            self.shown.append(visit.visitedCells[start:start + self.height])
+        for y in range(2 * self.height + 1):
+            j = j0 + (y - 1) // 2
+            line = []
+            for x in range(2 * self.width + 1):
+                i = i0 + (x - 1) // 2
+                if x % 2 and y % 2:
+                    if (i, j) == visit.currentPosition: line.append(self.currentCellChar)
+                    elif self.shown[i - i0][j - j0]: line.append(self.visitedCellChar)
+                    else: line.append(self.emptyCellChar)
+                elif y % 2:
+                    # Between (i, j) and (i+1, j)
+                    inside = 0 <= i < n - 1
+                    line.append(noWall if inside and not labyrinth.verticalWalls[i][j] else wall)
+                elif x % 2:
+                    # Between (i, j) and (i, j+1)
+                    inside = 0 <= j < m - 1
+                    line.append(noWall if inside and not labyrinth.horizontalWalls[i][j] else wall)
+                else:
+                    line.append(wall)
+            out.append("\x1b[{};1H{}".format(y + 1, "".join(line)))
+        self.current = visit.currentPosition